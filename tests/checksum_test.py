@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from videofilecheck.lib.checksum import checksum, block_checksum, BlockHashes
+import hashlib
+import tempfile
+import os
+import pytest
+
+
+class FakeBar:
+    desc = ""
+    n = 0
+    total = 0
+
+    def update(self, n):
+        self.n += n
+
+
+@pytest.fixture
+def videofile():
+    fd, p = tempfile.mkstemp()
+    os.write(fd, bytes(range(256)) * 1000)
+    os.close(fd)
+    yield p
+    os.unlink(p)
+
+
+def modify(path, pos):
+    with open(path, "r+b") as f:
+        f.seek(pos)
+        f.write(b"\xff\xfe")
+
+
+def test_block_checksum_matches_checksum(videofile):
+    filehash, blocks = block_checksum(videofile, FakeBar(), blocksize=10000)
+    assert filehash == checksum(videofile, FakeBar())
+    assert filehash == hashlib.md5(bytes(range(256)) * 1000).hexdigest()
+    assert len(blocks.digests) == 26
+
+
+def test_changed_blocks(videofile):
+    _, old = block_checksum(videofile, FakeBar(), blocksize=10000)
+    modify(videofile, 55000)
+    modify(videofile, 255999)
+    _, new = block_checksum(videofile, FakeBar(), blocksize=10000)
+
+    assert new.root != old.root
+    assert new.changed(old) == [5, 25]
+    assert new.byte_ranges([5, 6, 25], 256000) == [(50000, 70000), (250000, 256000)]
+
+
+def test_unchanged_blocks(videofile):
+    _, old = block_checksum(videofile, FakeBar(), blocksize=10000)
+    stored = BlockHashes(old.blocks, old.blocksize)
+    assert stored.root == old.root
+    assert old.changed(stored) == []
+
+
+def test_incomparable_blocks(videofile):
+    _, a = block_checksum(videofile, FakeBar(), blocksize=10000)
+    _, b = block_checksum(videofile, FakeBar(), blocksize=20000)
+    assert a.changed(b) is None
+    assert a.changed(None) is None
@@ -54,3 +54,44 @@ def test_db_set_get(dbpath):
 
     assert db.get("a/b", "hashsum", 99) is None
     assert db.get("a/c", "hashsum2", 99) is None
+
+
+def test_db_zeroes(dbpath):
+    db = Database(dbpath)
+    db.set_zeroes(dict(videofile="a/b", filesize=10, mtime=5, ranges=[(0, 10)]))
+
+    assert db.get_zeroes("a/b", 10, 5)["ranges"] == [(0, 10)]
+    assert db.get_zeroes("a/b", 11, 5) is None
+    assert db.get_zeroes("a/b", 10, 6) is None
+    assert db.get_zeroes("a/c", 10, 5) is None
+
+
+def test_db_find(dbpath):
+    db = Database(dbpath)
+    db.set(dict(videofile="a/b", hash="hashsum", filesize=1, status=False))
+    db.set(dict(videofile="a/c", hash="hashsum2", filesize=2, status=True))
+    assert [e["videofile"] for e in db.find(lambda e: e["status"] is False)] == ["a/b"]
+    assert db.get_entry("a/c")["hash"] == "hashsum2"
+    assert db.get_entry("wrongfile") is None
+
+
+def test_db_probes(dbpath):
+    db = Database(dbpath)
+    db.set_probe(dict(videofile="a/b", filesize=10, mtime=5, metadata={"duration": 1.0}))
+
+    assert db.get_probe("a/b", 10, 5)["metadata"] == {"duration": 1.0}
+    assert db.get_probe("a/b", None, None)["metadata"] == {"duration": 1.0}
+    assert db.get_probe("a/b", 10, 6) is None
+    assert db.get_probe("a/c", None, None) is None
+
+
+def test_db_rename(dbpath):
+    db = Database(dbpath)
+    db.set(dict(videofile="a/b", hash="hashsum", filesize=1, status=False))
+    db.set_zeroes(dict(videofile="a/b", filesize=1, mtime=5, ranges=[]))
+    db.rename("a/b", "root:a/b")
+
+    assert db.get_entry("a/b") is None
+    assert db.get_entry("root:a/b")["videofile"] == "root:a/b"
+    assert db.get_zeroes("a/b", 1, 5) is None
+    assert db.get_zeroes("root:a/b", 1, 5)["videofile"] == "root:a/b"
@@ -1,6 +1,18 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
-from videofilecheck.lib.ffmpeg import remove_ignored_stuff
+from videofilecheck.lib.ffmpeg import remove_ignored_stuff, Metadata, decode_options, time_ranges, RANGE_MARGIN, ffmpeg_scan_range
+import videofilecheck.lib.ffmpeg as ffmpeg
+
+PROBE = {
+    "format": {"duration": "60.000000", "bit_rate": "8000000"},
+    "streams": [
+        {"index": 0, "codec_type": "video", "codec_name": "av1", "width": 1920, "height": 1080},
+        {"index": 1, "codec_type": "audio", "codec_name": "aac"},
+        {"index": 2, "codec_type": "subtitle", "codec_name": "subrip"},
+        {"index": 3, "codec_type": "video", "codec_name": "mjpeg", "width": 600, "height": 600,
+         "disposition": {"attached_pic": 1}},
+    ],
+}
 
 
 def test_nothing_ignored():
@@ -32,3 +44,87 @@ def test_half_ignored():
     result = remove_ignored_stuff(source)
     result = result.strip()
     assert len(result) != 0
+
+
+def test_metadata_from_ffprobe():
+    metadata = Metadata.from_ffprobe(PROBE)
+    assert metadata.duration == 60.0
+    assert metadata.bitrate == 8000000
+    assert [s["index"] for s in metadata.video] == [0]
+    assert [s["index"] for s in metadata.audio] == [1]
+    assert metadata.height == 1080
+    assert metadata.cost == 60.0
+
+    # survives a round trip through the database
+    assert Metadata(metadata.info).cost == 60.0
+
+
+def test_metadata_unknown_duration():
+    metadata = Metadata.from_ffprobe({"format": {"duration": "N/A"}, "streams": []})
+    assert metadata.duration is None
+    assert metadata.cost is None
+
+
+def test_decode_options_without_metadata():
+    assert decode_options() == ([], [])
+    assert decode_options(None, "video") == ([], ["-map", "0:V?", "-an", "-sn", "-dn"])
+
+
+def test_decode_options():
+    metadata = Metadata.from_ffprobe(PROBE)
+
+    input_options, output_options = decode_options(metadata, "video", decoders=frozenset())
+    assert input_options[:1] == ["-threads"]
+    assert "-c:v" not in input_options
+    assert "-an" in output_options
+
+    input_options, _ = decode_options(metadata, "default", decoders=frozenset(["libdav1d"]))
+    assert input_options[-2:] == ["-c:v", "libdav1d"]
+
+
+def test_decode_options_video_mode_audio_only():
+    metadata = Metadata.from_ffprobe({"format": {}, "streams": [{"index": 0, "codec_type": "audio"}]})
+    assert decode_options(metadata, "video") == ([], [])
+
+
+# (position, time, stream, keyframe): keyframes every 2s, one video and one audio packet per second
+PACKETS = [(1000 * t + 100 * stream, float(t), stream, stream == 0 and t % 2 == 0) for t in range(10) for stream in (0, 1)]
+
+
+def test_time_ranges():
+    assert time_ranges(PACKETS, [(3050, 3150)]) == [(2.0, 4.0)]
+    assert time_ranges(PACKETS, [(3050, 3150), (3500, 5050)]) == [(2.0, 6.0)]
+    assert time_ranges(PACKETS, [(1050, 1150), (7000, 7200)]) == [(0.0, 2.0), (6.0, 8.0)]
+    assert time_ranges(PACKETS, [(9000, 20000)]) == [(8.0, None)]
+
+
+def test_time_ranges_header_only():
+    packets = [(p + 500, t, s, k) for p, t, s, k in PACKETS]
+    assert time_ranges(packets, [(0, 400)]) == []
+
+
+def test_time_ranges_without_keyframes():
+    packets = [(p, t, s, False) for p, t, s, _ in PACKETS]
+    assert time_ranges(packets, [(3050, 3150)]) == [(0.0, 3.0 + RANGE_MARGIN)]
+
+
+def test_scan_range_with_start_time(monkeypatch):
+    # e.g. remuxed from a transport stream: timestamps start at 1.4s instead of 0
+    packets = [(p, t + 1.4, s, k) for p, t, s, k in PACKETS]
+    assert time_ranges(packets, [(3050, 3150)]) == [(3.4, 5.4)]
+
+    calls = []
+
+    def popen(call, **kw):
+        calls.append(call)
+        raise OSError("no ffmpeg")
+
+    monkeypatch.setattr(ffmpeg.subprocess, "Popen", popen)
+    assert not ffmpeg_scan_range("video.mkv", 3.4, 5.4).success
+
+    # -ss is the absolute timestamp from the packet index, not offset by the start time
+    call = calls[0]
+    i = call.index("-ss")
+    assert call[i - 2:i + 2] == ["-seek_timestamp", "1", "-ss", "3.400"]
+    assert call.index("-ss") < call.index("-i")
+    assert call[call.index("-t") + 1] == "2.000"
@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from videofilecheck.lib.report import open_report, entry_filter, parse_timestamp, Report, TextReport, CsvReport, JsonLinesReport
+from datetime import datetime
+import tempfile
+import json
+import csv
+import os
+import pytest
+
+OK = dict(videofile="a/ok.mkv", status=True, timestamp=100, filesize=1, output="")
+BROKEN = dict(videofile="a/broken.mkv", status=False, timestamp=200, filesize=2, output="error while decoding")
+TIMEOUT = dict(videofile="b/stuck.mkv", status=False, timestamp=300, filesize=3, output="Timeout: no progress", timeout=True)
+ENTRIES = [OK, BROKEN, TIMEOUT]
+
+
+@pytest.fixture
+def outdir():
+    with tempfile.TemporaryDirectory() as d:
+        yield d
+
+
+def matching(**kw):
+    return [e["videofile"] for e in ENTRIES if entry_filter(**kw)(e)]
+
+
+def test_format_from_extension(outdir):
+    for name, cls in [("r.txt", TextReport), ("r.csv", CsvReport), ("r.jsonl", JsonLinesReport)]:
+        with open_report(os.path.join(outdir, name)) as report:
+            assert isinstance(report, cls)
+
+    with open_report(os.path.join(outdir, "r.txt"), "csv") as report:
+        assert isinstance(report, CsvReport)
+
+
+def test_text_report(outdir):
+    path = os.path.join(outdir, "results.txt")
+    with open_report(path) as report:
+        for entry in ENTRIES:
+            report.write(entry)
+        assert report.count == 3
+
+    with open(path, "rt", encoding="utf-8") as f:
+        lines = f.read().splitlines()
+
+    assert lines[0] == "  OK   a/ok.mkv"
+    assert lines[1] == "FAILED a/broken.mkv"
+    assert lines[2] == "> error while decoding"
+    assert lines[3] == "TIMEOUT b/stuck.mkv"
+    assert lines[4] == "> Timeout: no progress"
+
+
+def test_report_is_abstract(outdir):
+    with pytest.raises(TypeError):
+        Report(os.path.join(outdir, "results.txt"))
+
+
+def test_incremental_report(outdir):
+    path = os.path.join(outdir, "results.jsonl")
+    with open_report(path) as report:
+        report.write(OK)
+
+        with open(path, "rt", encoding="utf-8") as f:
+            assert json.loads(f.readline()) == OK
+
+
+def test_csv_report(outdir):
+    path = os.path.join(outdir, "results.csv")
+    with open_report(path) as report:
+        for entry in ENTRIES:
+            report.write(entry)
+
+    with open(path, "rt", encoding="utf-8", newline="") as f:
+        rows = list(csv.DictReader(f))
+
+    assert [r["status"] for r in rows] == ["OK", "FAILED", "TIMEOUT"]
+    assert rows[1]["output"] == "error while decoding"
+
+
+def test_filters():
+    assert matching() == ["a/ok.mkv", "a/broken.mkv", "b/stuck.mkv"]
+    assert matching(status="ok") == ["a/ok.mkv"]
+    assert matching(status="failed") == ["a/broken.mkv", "b/stuck.mkv"]
+    assert matching(status="timeout") == ["b/stuck.mkv"]
+    assert matching(prefix="a/") == ["a/ok.mkv", "a/broken.mkv"]
+    assert matching(since=200) == ["a/broken.mkv", "b/stuck.mkv"]
+    assert matching(before=200) == ["a/ok.mkv"]
+    assert matching(error="decoding") == ["a/broken.mkv"]
+    assert matching(status="failed", prefix="a/") == ["a/broken.mkv"]
+
+    with pytest.raises(ValueError):
+        entry_filter(status="unknown")
+
+
+def test_prefix_ignores_filesystem_id():
+    entries = [dict(OK, videofile="1111-AAAA:a/ok.mkv"), dict(BROKEN, videofile="nas:/volume1:a/broken.mkv"),
+               dict(TIMEOUT, videofile="nas:/volume1:b/stuck.mkv")]
+    match = entry_filter(prefix="a/")
+    assert [e["videofile"] for e in entries if match(e)] == ["1111-AAAA:a/ok.mkv", "nas:/volume1:a/broken.mkv"]
+
+
+def test_parse_timestamp():
+    assert parse_timestamp("12345") == 12345
+    assert parse_timestamp("2020-01-31") == int(datetime(2020, 1, 31).timestamp())
+    assert parse_timestamp("2020-01-31 12:30") == int(datetime(2020, 1, 31, 12, 30).timestamp())
+
+    with pytest.raises(ValueError):
+        parse_timestamp("yesterday")
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from videofilecheck.lib.roots import Root, find_mount, filesystem_id, read_roots_file, split_key
+import tempfile
+import os
+import pytest
+
+MOUNTINFO = (
+    "22 1 8:1 / / rw,relatime shared:1 - ext4 /dev/sda1 rw\n"
+    "30 22 0:25 / /dev/shm rw shared:2 - tmpfs tmpfs rw\n"
+    "40 22 8:17 / /mnt/disk1 rw shared:3 - xfs /dev/sdb1 rw\n"
+    "41 22 8:33 / /mnt/disk\\0402 rw shared:4 - xfs /dev/sdc1 rw\n"
+    "42 22 0:50 /media /srv/media rw shared:5 - xfs /dev/sdb1 rw\n"
+    "43 22 0:51 / /mnt/nas rw shared:6 - nfs4 nas:/volume1 rw\n"
+)
+
+
+@pytest.fixture
+def env():
+    with tempfile.TemporaryDirectory() as d:
+        mountinfo = os.path.join(d, "mountinfo")
+        with open(mountinfo, "wt") as f:
+            f.write(MOUNTINFO)
+
+        devdir = os.path.join(d, "disk")
+        os.makedirs(os.path.join(devdir, "by-uuid"))
+        os.makedirs(os.path.join(devdir, "by-label"))
+        os.symlink("/dev/sdb1", os.path.join(devdir, "by-uuid", "1111-AAAA"))
+        os.symlink("/dev/sdc1", os.path.join(devdir, "by-label", "My\\x20Disk"))
+
+        yield mountinfo, devdir
+
+
+def test_find_mount(env):
+    mountinfo, _ = env
+    assert find_mount("/mnt/disk1/movies", mountinfo) == ("/mnt/disk1", "/", "/dev/sdb1")
+    assert find_mount("/mnt/disk 2", mountinfo) == ("/mnt/disk 2", "/", "/dev/sdc1")
+    assert find_mount("/mnt/disk10", mountinfo) == ("/", "/", "/dev/sda1")
+
+
+def test_filesystem_id(env):
+    _, devdir = env
+    assert filesystem_id("/dev/sdb1", "/mnt/disk1", devdir) == "1111-AAAA"
+    assert filesystem_id("/dev/sdc1", "/mnt/disk 2", devdir) == "My Disk"
+    assert filesystem_id("/dev/sda1", "/", devdir) == "/dev/sda1"
+    assert filesystem_id("nas:/volume1", "/mnt/nas", devdir) == "nas:/volume1"
+    assert filesystem_id("tmpfs", "/dev/shm", devdir) == "tmpfs@/dev/shm"
+
+
+def test_keys_do_not_depend_on_mountpoint(env):
+    mountinfo, devdir = env
+    direct = Root("/mnt/disk1/media/movies", mountinfo, devdir)
+    bind = Root("/srv/media/movies", mountinfo, devdir)
+
+    assert direct.key("a/b.mkv") == "1111-AAAA:media/movies/a/b.mkv"
+    assert bind.key("a/b.mkv") == direct.key("a/b.mkv")
+
+    assert bind.owns(direct.key("a/b.mkv"))
+    assert bind.path_of(direct.key("a/b.mkv")) == "/srv/media/movies/a/b.mkv"
+
+
+def test_roots_do_not_clash(env):
+    mountinfo, devdir = env
+    disk1 = Root("/mnt/disk1", mountinfo, devdir)
+    disk2 = Root("/mnt/disk 2", mountinfo, devdir)
+
+    assert disk1.key("a.mkv") == "1111-AAAA:a.mkv"
+    assert disk2.key("a.mkv") == "My Disk:a.mkv"
+    assert not disk1.owns(disk2.key("a.mkv"))
+    assert disk2.path_of(disk2.key("a.mkv")) == "/mnt/disk 2/a.mkv"
+
+
+def test_owns_subdirectory_only(env):
+    mountinfo, devdir = env
+    movies = Root("/mnt/disk1/movies", mountinfo, devdir)
+    assert movies.owns("1111-AAAA:movies/a.mkv")
+    assert not movies.owns("1111-AAAA:movies2/a.mkv")
+    assert not movies.owns("1111-AAAA:tv/a.mkv")
+
+
+def test_key_prefix(env):
+    mountinfo, devdir = env
+    movies = Root("/mnt/disk1/movies", mountinfo, devdir)
+    assert movies.key_prefix() == "1111-AAAA:movies/"
+    assert movies.key_prefix("a/") == "1111-AAAA:movies/a/"
+    assert movies.key_prefix("a/S01") == "1111-AAAA:movies/a/S01"
+
+    disk2 = Root("/mnt/disk 2", mountinfo, devdir)
+    assert disk2.key_prefix() == "My Disk:"
+    assert disk2.key_prefix("./a/") == "My Disk:a/"
+
+
+def test_split_key(env):
+    mountinfo, devdir = env
+    for path in ("/mnt/disk1/movies", "/mnt/nas/movies", "/mnt/disk 2"):
+        root = Root(path, mountinfo, devdir)
+        assert split_key(root.key("a/b: c.mkv")) == (root.id, root.key("a/b: c.mkv")[len(root.id) + 1:])
+
+    assert split_key("nas:/volume1:movies/a.mkv") == ("nas:/volume1", "movies/a.mkv")
+    assert split_key("[fe80::1]:/export:a.mkv") == ("[fe80::1]:/export", "a.mkv")
+    assert split_key("user@host::a.mkv") == ("user@host:", "a.mkv")
+
+    # keys of older databases are relative paths
+    assert split_key("a/b.mkv") == ("", "a/b.mkv")
+
+
+def test_read_roots_file():
+    with tempfile.NamedTemporaryFile("wt", suffix=".txt", delete=False) as f:
+        f.write("# disks\n/mnt/disk1\n\n  /mnt/disk2  \n")
+
+    try:
+        assert read_roots_file(f.name) == ["/mnt/disk1", "/mnt/disk2"]
+    finally:
+        os.unlink(f.name)
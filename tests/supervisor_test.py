@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from videofilecheck.lib.supervisor import Supervisor, Job, MIN_STALL_TIMEOUT, REFERENCE_BITRATE
+import subprocess
+import sys
+
+PROGRESS = "frame=1\\nout_time_us=40000\\nprogress=continue"
+FAKE_FFMPEG = "import time, sys; print('%s', flush=True); sys.stderr.write('err'); sys.stderr.flush(); time.sleep(30)" % PROGRESS
+
+
+def fake_ffmpeg():
+    return subprocess.Popen([sys.executable, "-c", FAKE_FFMPEG], stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                            stderr=subprocess.PIPE)
+
+
+def test_parse_progress():
+    job = Job(None, "test")
+    job.parse_progress(b"frame=10\nout_time_us=400")
+    assert job.frame == 0
+
+    assert job.speed is None
+
+    job.parse_progress(b"000\nspeed=2.5x\nprogress=continue\n")
+    assert job.frame == 10
+    assert job.speed == 2.5
+    assert job.out_time == 400000
+
+    job.parse_progress(b"frame=N/A\nout_time_us=N/A\nprogress=continue\n")
+    assert job.frame == 10
+    assert job.out_time == 400000
+
+
+def test_stall_timeout_scales_with_bitrate():
+    job = Job(None, "test")
+    assert job.stall_timeout() == MIN_STALL_TIMEOUT
+
+    job.out_time = 1000000
+    job.fed = 4 * REFERENCE_BITRATE // 8
+    assert job.stall_timeout() == 4 * MIN_STALL_TIMEOUT
+
+
+def test_kill_stuck_process():
+    supervisor = Supervisor(min_stall_timeout=0.5, interval=0.1)
+    job = supervisor.watch(fake_ffmpeg(), "stuck")
+    job.close_input()
+
+    assert job.done.wait(10)
+    job.proc.wait()
+    assert job.killed is not None
+    assert job.frame == 1
+    assert job.output == b"err"
+
+
+def test_waiting_for_input_is_not_stuck():
+    supervisor = Supervisor(min_stall_timeout=0.5, interval=0.1)
+    job = supervisor.watch(fake_ffmpeg(), "waiting")
+
+    assert not job.done.wait(1.5)
+    assert job.killed is None
+
+    job.proc.kill()
+    assert job.done.wait(10)
+    job.proc.wait()
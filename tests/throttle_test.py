@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from videofilecheck.lib.throttle import TokenBucket, AdaptiveConcurrency
+from time import monotonic
+
+
+def test_unlimited_bucket():
+    bucket = TokenBucket()
+    start = monotonic()
+    for _ in range(1000):
+        bucket.consume(1024 * 1024)
+    assert monotonic() - start < 0.5
+
+
+def test_limited_bucket():
+    bucket = TokenBucket(rate=1000, burst=100)
+    start = monotonic()
+    for _ in range(4):
+        bucket.consume(100)
+    elapsed = monotonic() - start
+    assert 0.25 < elapsed < 1.0
+
+
+def test_concurrency_adapts_to_latency():
+    limiter = AdaptiveConcurrency(maximum=4, target_latency=0.01, interval=0)
+    assert limiter.limit == 4
+
+    limiter.record(0.1)
+    limiter.record(0.1)
+    assert limiter.limit == 2
+
+    for _ in range(10):
+        limiter.record(0.1)
+    assert limiter.limit == 1
+
+    for _ in range(10):
+        limiter.record(0.001)
+    assert limiter.limit == 4
+
+
+def test_concurrency_sees_stalls_between_fast_reads():
+    limiter = AdaptiveConcurrency(maximum=4, target_latency=0.01, interval=3600)
+
+    # readahead serves most reads in microseconds, but every 5th read waits for the disk
+    for i in range(99):
+        limiter.record(0.1 if i % 5 == 0 else 0.00001)
+    assert limiter.limit == 4
+
+    # end of the interval
+    limiter.last_adjust -= 3600
+    limiter.record(0.00001)
+    assert limiter.latency == 0.1
+    assert limiter.limit == 3
+
+
+def test_concurrency_without_target():
+    limiter = AdaptiveConcurrency(maximum=2)
+    limiter.record(100)
+    assert limiter.limit == 2
+
+    with limiter, limiter:
+        assert limiter.active == 2
+    assert limiter.active == 0
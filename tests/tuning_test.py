@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from videofilecheck.lib.tuning import ConcurrencyTuner, SystemSampler, devices_of
+from videofilecheck.lib.throttle import AdaptiveConcurrency
+import tempfile
+import os
+import pytest
+
+DISKSTATS = ("   8       0 sda %d 0 %d 0 0 0 0 0 0 %d 0\n   7       0 loop0 1 0 99999 0 0 0 0 0 0 99999 0\n"
+             "   8      16 sdb 0 0 0 0 0 0 0 0 0 %d 0\n")
+
+
+@pytest.fixture
+def proc():
+    with tempfile.TemporaryDirectory() as d:
+        yield d
+
+
+def write_proc(proc, cpu, disk, other_disk=0):
+    with open(os.path.join(proc, "stat"), "wt") as f:
+        f.write("cpu  %d 0 0 %d 0 0 0 0 0 0\ncpu0 1 2 3 4\n" % cpu)
+    with open(os.path.join(proc, "diskstats"), "wt") as f:
+        f.write(DISKSTATS % (disk + (other_disk,)))
+
+
+def test_sampler(proc):
+    write_proc(proc, (100, 100), (0, 0, 0))
+    sampler = SystemSampler(proc)
+    write_proc(proc, (175, 125), (10, 2048, 10000000))
+
+    sample = sampler.sample()
+    assert sample["cpu"] == 0.75
+    assert sample["disk"] == "sda"
+    assert sample["disk_busy"] == 1.0
+    assert sample["disk_read"] > 0
+
+
+def test_sampler_only_uses_given_devices(proc):
+    write_proc(proc, (100, 100), (0, 0, 0))
+    sampler = SystemSampler(proc, devices={(8, 0)})
+    write_proc(proc, (175, 125), (10, 2048, 0), other_disk=10000000)
+
+    sample = sampler.sample()
+    assert sample["disk"] == "sda"
+    assert sample["disk_busy"] == 0.0
+
+
+def test_devices_of(proc):
+    dev = os.stat(proc).st_dev
+    assert devices_of([proc]) == {(os.major(dev), os.minor(dev))}
+
+
+def test_sampler_without_proc(proc):
+    sample = SystemSampler(os.path.join(proc, "missing")).sample()
+    assert sample["cpu"] is None
+    assert sample["disk_busy"] is None
+
+
+def make_tuner(level=2):
+    limiter = AdaptiveConcurrency(maximum=8)
+    limiter.set_limit(level)
+    return limiter, ConcurrencyTuner(limiter, 1, 4)
+
+
+def test_tuner_grows_with_headroom():
+    limiter, tuner = make_tuner()
+    tuner.update(dict(cpu=0.3, disk_busy=0.2))
+    assert limiter.limit == 3
+
+    for _ in range(5):
+        tuner.update(dict(cpu=0.3, disk_busy=0.2))
+    assert limiter.limit == 4
+
+
+def test_tuner_shrinks_when_saturated():
+    limiter, tuner = make_tuner(3)
+    tuner.update(dict(cpu=0.3, disk_busy=1.0))
+    assert limiter.limit == 2
+
+    tuner.update(dict(cpu=0.85, disk_busy=0.5))
+    assert limiter.limit == 2
+
+    for _ in range(5):
+        tuner.update(dict(cpu=0.99, disk_busy=None))
+    assert limiter.limit == 1
+
+
+def test_tuner_reverts_slower_level():
+    limiter, tuner = make_tuner()
+    tuner.update(dict(cpu=0.5, disk_busy=0.5, speed=4.0))
+    assert limiter.limit == 3
+
+    tuner.update(dict(cpu=0.5, disk_busy=0.5, speed=3.0))
+    assert limiter.limit == 2
+
+
+def test_tuner_without_samples():
+    limiter, tuner = make_tuner()
+    tuner.update(dict(cpu=None, disk_busy=None))
+    assert limiter.limit == 2
+
+
+def test_tuner_uses_read_latency():
+    limiter, tuner = make_tuner(3)
+    tuner.update(dict(cpu=0.3, disk_busy=0.2, latency=0.05, target_latency=0.02))
+    assert limiter.limit == 2
+
+    # headroom, but the latency is not well below the target
+    tuner.update(dict(cpu=0.3, disk_busy=0.2, latency=0.015, target_latency=0.02))
+    assert limiter.limit == 2
+
+    tuner.update(dict(cpu=0.3, disk_busy=0.2, latency=0.005, target_latency=0.02))
+    assert limiter.limit == 3
+
+
+def test_latency_does_not_change_tuned_limit():
+    limiter = AdaptiveConcurrency(maximum=4, target_latency=0.01, interval=0, adjust=False)
+    limiter.set_limit(2)
+
+    limiter.record(0.1)
+    assert limiter.latency == 0.1
+    assert limiter.limit == 2
@@ -0,0 +1,315 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import argparse
+import shutil
+import tempfile
+import os
+import pytest
+
+pytest.importorskip("tqdm")
+
+import videofilecheck.videofilecheck as vfc  # noqa: E402
+from videofilecheck.lib.cache import UnCachedFile  # noqa: E402
+from videofilecheck.lib.zeroes import BLOCKSIZE  # noqa: E402
+from videofilecheck.lib.roots import split_key  # noqa: E402
+
+
+@pytest.fixture
+def tmpdir():
+    p = tempfile.mkdtemp()
+    yield p
+    shutil.rmtree(p)
+
+
+def make_app(dbpath, **options):
+    config = argparse.Namespace(
+        nthreads="1", min_threads=None, max_threads=None, dbpath=dbpath, force_rescan=False, path_only=False,
+        zero_check=False, read_limit=None, max_latency=None, verbose=False, output="-", format=None, mode=None,
+    )
+    vars(config).update(options)
+    return vfc.App(config)
+
+
+def write(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+class CopiedFile(UnCachedFile):
+    """CachedFile that always copies to a known location, so the tests can tell the copy from the original"""
+
+    def __init__(self, src, bar=None):
+        super().__init__(src, bar)
+        self._cached = src + ".cached"
+        shutil.copyfile(src, self._cached)
+
+    def __exit__(self, *exc):
+        os.unlink(self._cached)
+
+
+def test_zero_check_reads_cached_copy_before_hashing(tmpdir, monkeypatch):
+    path = os.path.join(tmpdir, "lib", "zeroed.mkv")
+    write(path, b"\x01" * BLOCKSIZE + bytes(2 * BLOCKSIZE))
+
+    calls = []
+    find_zero_ranges, block_checksum = vfc.find_zero_ranges, vfc.block_checksum
+    monkeypatch.setattr(vfc, "CachedFile", CopiedFile)
+    monkeypatch.setattr(vfc, "find_zero_ranges", lambda f, bar=None: calls.append(("zero", f)) or find_zero_ranges(f, bar))
+    monkeypatch.setattr(vfc, "block_checksum", lambda f, bar: calls.append(("hash", f)) or block_checksum(f, bar))
+    monkeypatch.setattr(vfc, "ffmpeg_scan", lambda *args: calls.append(("decode", args[0])))
+
+    app = make_app(os.path.join(tmpdir, "db.json"), zero_check=True)
+    assert app.worker("zeroed.mkv", path) == ("zeroed.mkv", False, False)
+
+    assert calls == [("zero", path + ".cached"), ("hash", path + ".cached")]
+    assert "Zeroed tail" in app.db.get_entry("zeroed.mkv")["output"]
+
+
+def probe_info(duration, width=1920, height=1080):
+    return dict(duration=duration, bitrate=None, streams=[dict(index=0, type="video", codec="h264", width=width, height=height)])
+
+
+def test_progress_weighted_by_decoding_cost(tmpdir):
+    app = make_app(os.path.join(tmpdir, "db.json"))
+    items = [("short.mkv", "/short.mkv"), ("long.mkv", "/long.mkv"), ("new.mkv", "/new.mkv")]
+    assert app.progress_weights(items) is None
+
+    app.db.set_probe(dict(videofile="short.mkv", filesize=1, mtime=1, metadata=probe_info(60)))
+    app.db.set_probe(dict(videofile="long.mkv", filesize=1, mtime=1, metadata=probe_info(60, 3840, 2160)))
+
+    # 4k decodes four times slower, the unknown file counts as an average one
+    assert app.progress_weights(items) == [60, 240, 150]
+
+
+class Progress:
+    """Records total and progress of the bars created by the App"""
+    bars = []
+
+    def __init__(self, *args, total=None, **kw):
+        self.total, self.n, self.desc = total, 0, ""
+        Progress.bars.append(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+    def update(self, n):
+        self.n += n
+
+    def refresh(self):
+        pass
+
+
+def test_progress_counts_only_decoded_files(tmpdir, monkeypatch):
+    app = make_app(os.path.join(tmpdir, "db.json"))
+    items = [("cached.mkv", "/cached.mkv"), ("changed.mkv", "/changed.mkv")]
+    for vfile, _ in items:
+        app.db.set_probe(dict(videofile=vfile, filesize=1, mtime=1, metadata=probe_info(60)))
+
+    Progress.bars = []
+    monkeypatch.setattr(vfc, "tqdm", Progress)
+    monkeypatch.setattr(app, "worker", lambda key, path, force=False: (key, True, key == "changed.mkv"))
+    app.scan_files(items, "-", [])
+
+    # the file that was only hashed is removed from the work the ETA is based on
+    progress = Progress.bars[0]
+    assert (progress.total, progress.n) == (60, 60)
+
+
+@pytest.fixture
+def failed_library(tmpdir):
+    """Library with two failed, one good and one deleted file. Returns the app, the root and the file paths"""
+    libdir = os.path.join(tmpdir, "lib")
+    paths = dict((name, os.path.join(libdir, name)) for name in ("a/broken.mkv", "a/old.mkv", "b/ok.mkv"))
+    for path in paths.values():
+        write(path, b"\x01" * 1024)
+
+    app = make_app(os.path.join(tmpdir, "db.json"))
+    root = vfc.Root(libdir)
+    for name, status, timestamp, output in [("a/broken.mkv", False, 300, "decoding error"), ("a/old.mkv", False, 100, "old error"),
+                                            ("b/ok.mkv", True, 300, ""), ("b/gone.mkv", False, 300, "decoding error")]:
+        app.db.set(dict(videofile=root.key(name), hash="x", status=status, timestamp=timestamp, filesize=1024, output=output))
+
+    return app, root, paths
+
+
+def test_rescan_submits_only_matching_failed_files(failed_library, monkeypatch):
+    app, root, paths = failed_library
+
+    def no_walk(*args):
+        raise AssertionError("rescan must not search the directories")
+
+    submitted = []
+    monkeypatch.setattr(vfc, "walk", no_walk)
+    monkeypatch.setattr(app, "worker", lambda key, path, force=False: submitted.append((key, path, force)) or (key, False, True))
+
+    # b/gone.mkv failed as well, but it does not exist anymore
+    app.rescan([root.path])
+    assert sorted(submitted) == [(root.key("a/broken.mkv"), paths["a/broken.mkv"], True),
+                                 (root.key("a/old.mkv"), paths["a/old.mkv"], True)]
+
+    submitted.clear()
+    app.rescan([root.path], since=200)
+    assert submitted == [(root.key("a/broken.mkv"), paths["a/broken.mkv"], True)]
+
+    submitted.clear()
+    app.rescan([root.path], error="old")
+    assert submitted == [(root.key("a/old.mkv"), paths["a/old.mkv"], True)]
+
+
+def test_rescan_keeps_results_of_last_scan(failed_library, tmpdir, monkeypatch, capsys):
+    app, root, paths = failed_library
+    app.output = None
+
+    monkeypatch.chdir(tmpdir)
+    write(os.path.join(tmpdir, "results.txt"), b"FAILED full library\n")
+    monkeypatch.setattr(app, "worker", lambda key, path, force=False: (key, False, True))
+
+    app.rescan([root.path])
+    with open(os.path.join(tmpdir, "results.txt"), "rb") as f:
+        assert f.read() == b"FAILED full library\n"
+    assert "FAILED %s" % root.key("a/broken.mkv") in capsys.readouterr().out
+
+
+def test_forced_rescan_hashes_once(failed_library, monkeypatch):
+    app, root, paths = failed_library
+
+    hashed = []
+    block_checksum = vfc.block_checksum
+    monkeypatch.setattr(vfc, "CachedFile", CopiedFile)
+    monkeypatch.setattr(vfc, "block_checksum", lambda f, bar: hashed.append(f) or block_checksum(f, bar))
+    monkeypatch.setattr(vfc, "ffprobe", lambda f: vfc.Metadata(probe_info(60)))
+    monkeypatch.setattr(vfc, "ffmpeg_scan", lambda *args: vfc.Result(""))
+
+    app.rescan([root.path])
+    assert sorted(hashed) == [paths["a/broken.mkv"] + ".cached", paths["a/old.mkv"] + ".cached"]
+    assert app.db.get_entry(root.key("a/broken.mkv"))["status"]
+    assert app.db.get_entry(root.key("b/gone.mkv"))["status"] is False
+
+
+@pytest.fixture
+def changed_library(tmpdir, monkeypatch):
+    """
+    A good file hashed in 1k blocks with a packet every 256 bytes (one second each) and a keyframe every 1k.
+    Returns the app, the path and the list that records the decoded time ranges (None for the whole file)
+    """
+    path = os.path.join(tmpdir, "lib", "video.mkv")
+    write(path, bytes(range(256)) * 14)
+
+    decoded = []
+    block_checksum = vfc.block_checksum
+    monkeypatch.setattr(vfc, "CachedFile", CopiedFile)
+    monkeypatch.setattr(vfc, "block_checksum", lambda f, bar: block_checksum(f, bar, blocksize=1024))
+    monkeypatch.setattr(vfc, "ffprobe", lambda f: vfc.Metadata(probe_info(14)))
+    monkeypatch.setattr(vfc, "header_check", lambda f: vfc.Result(""))
+    monkeypatch.setattr(vfc, "packet_index", lambda f: [(pos, pos / 256, 0, pos % 1024 == 0) for pos in range(0, 3584, 256)])
+    monkeypatch.setattr(vfc, "ffmpeg_scan", lambda *args: decoded.append(None) or vfc.Result(""))
+    monkeypatch.setattr(vfc, "ffmpeg_scan_range", lambda f, start, end, options: decoded.append((start, end)) or vfc.Result(""))
+
+    app = make_app(os.path.join(tmpdir, "db.json"))
+    assert app.worker("video.mkv", path) == ("video.mkv", True, True)
+    assert decoded == [None]
+    decoded.clear()
+
+    return app, path, decoded
+
+
+def test_partial_scan_decodes_changed_blocks(changed_library):
+    app, path, decoded = changed_library
+
+    with open(path, "r+b") as f:
+        f.seek(2048 + 100)
+        f.write(b"changed")
+
+    assert app.worker("video.mkv", path) == ("video.mkv", True, True)
+    assert decoded == [(4.0, 12.0)]
+
+
+@pytest.mark.parametrize("size", [3584 + 100, 3584 - 100])
+def test_partial_scan_not_used_after_size_change(changed_library, size):
+    app, path, decoded = changed_library
+
+    # same number of blocks, only the last one changed
+    with open(path, "r+b") as f:
+        f.truncate(size)
+
+    assert app.worker("video.mkv", path) == ("video.mkv", True, True)
+    assert decoded == [None]
+
+
+def test_show_prefix(failed_library, capsys):
+    app, root, paths = failed_library
+
+    app.show(prefix=os.path.join(root.path, "a") + "/")
+    assert capsys.readouterr().out.splitlines() == ["FAILED %s" % root.key("a/broken.mkv"), "> decoding error",
+                                                    "FAILED %s" % root.key("a/old.mkv"), "> old error"]
+
+    # relative to the filesystem, without its id
+    app.show(status="all", prefix=split_key(root.key("b"))[1] + "/")
+    assert capsys.readouterr().out.splitlines() == ["  OK   %s" % root.key("b/ok.mkv"),
+                                                    "FAILED %s" % root.key("b/gone.mkv"), "> decoding error"]
+
+
+def test_rescan_prefix_relative_to_roots(failed_library, monkeypatch):
+    app, root, paths = failed_library
+
+    submitted = []
+    monkeypatch.setattr(app, "worker", lambda key, path, force=False: submitted.append(key) or (key, False, True))
+
+    app.rescan([root.path], prefix="a/b")
+    assert submitted == [root.key("a/broken.mkv")]
+
+
+def test_migration_only_for_unambiguous_paths(tmpdir):
+    for name in ("disk1/x.mkv", "disk2/x.mkv", "disk1/only1.mkv"):
+        write(os.path.join(tmpdir, name), b"\x01")
+
+    app = make_app(os.path.join(tmpdir, "db.json"))
+    for name in ("x.mkv", "only1.mkv"):
+        app.db.set(dict(videofile=name, hash="x", status=False, timestamp=1, filesize=1, output=""))
+
+    disk1, disk2 = vfc.Root(os.path.join(tmpdir, "disk1")), vfc.Root(os.path.join(tmpdir, "disk2"))
+    app.collect([disk1, disk2])
+
+    assert app.db.get_entry("only1.mkv") is None
+    assert app.db.get_entry(disk1.key("only1.mkv")) is not None
+
+    assert app.db.get_entry("x.mkv") is not None
+    assert app.db.get_entry(disk1.key("x.mkv")) is None
+    assert app.db.get_entry(disk2.key("x.mkv")) is None
+
+    # the same holds for rescan, which takes its work list from the database
+    submitted = []
+    app.worker = lambda key, path, force=False: submitted.append(key) or (key, False, True)
+    app.rescan([disk1.path, disk2.path])
+    assert submitted == [disk1.key("only1.mkv")]
+    assert app.db.get_entry("x.mkv") is not None
+
+    # with a single directory, the path is unambiguous
+    app.rescan([disk2.path])
+    assert submitted == [disk1.key("only1.mkv"), disk2.key("x.mkv")]
+    assert app.db.get_entry("x.mkv") is None
+
+
+def test_prune_removes_unmigrated_legacy_entries(tmpdir):
+    for name in ("disk1/x.mkv", "disk2/x.mkv", "disk1/only1.mkv"):
+        write(os.path.join(tmpdir, name), b"\x01")
+
+    app = make_app(os.path.join(tmpdir, "db.json"))
+    disk1, disk2 = vfc.Root(os.path.join(tmpdir, "disk1")), vfc.Root(os.path.join(tmpdir, "disk2"))
+    for key in ("x.mkv", "only1.mkv", "gone/old.mkv", disk1.key("deleted.mkv"), "other:a.mkv"):
+        app.db.set(dict(videofile=key, hash="x", status=False, timestamp=1, filesize=1, output=""))
+
+    app.prune([disk1.path, disk2.path])
+
+    # deleted before the upgrade, so it was never migrated
+    assert app.db.get_entry("gone/old.mkv") is None
+    assert app.db.get_entry(disk1.key("deleted.mkv")) is None
+
+    # ambiguous legacy entries, migrated entries and entries of other filesystems are kept
+    assert app.db.get_entry("x.mkv") is not None
+    assert app.db.get_entry(disk1.key("only1.mkv")) is not None
+    assert app.db.get_entry("other:a.mkv") is not None
@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from videofilecheck.lib.zeroes import find_zero_ranges, BLOCKSIZE
+import tempfile
+import os
+import pytest
+
+
+@pytest.fixture
+def videofile():
+    fd, p = tempfile.mkstemp()
+    os.close(fd)
+    yield p
+    os.unlink(p)
+
+
+def write(path, data):
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+def test_no_zeroes(videofile):
+    write(videofile, b"\x01" * (3 * BLOCKSIZE + 17))
+    result = find_zero_ranges(videofile)
+    assert result.success
+    assert result.ranges == []
+
+
+def test_small_padding_ignored(videofile):
+    write(videofile, b"\x01" * 2048 + bytes(BLOCKSIZE - 1) + b"\x01" * BLOCKSIZE)
+    assert find_zero_ranges(videofile).success
+
+
+def test_zeroed_header(videofile):
+    write(videofile, bytes(1024) + b"\x01" * BLOCKSIZE)
+    result = find_zero_ranges(videofile)
+    assert not result.success
+    assert result.ranges == [(0, 1024)]
+
+
+def test_zeroed_middle(videofile):
+    write(videofile, b"\x01" * BLOCKSIZE + bytes(2 * BLOCKSIZE) + b"\x01" * BLOCKSIZE)
+    result = find_zero_ranges(videofile)
+    assert result.ranges == [(BLOCKSIZE, 3 * BLOCKSIZE)]
+    assert not result.truncated
+
+
+def test_truncated_tail(videofile):
+    write(videofile, b"\x01" * BLOCKSIZE + bytes(200 * BLOCKSIZE + 5))
+    result = find_zero_ranges(videofile)
+    assert result.ranges == [(BLOCKSIZE, 201 * BLOCKSIZE + 5)]
+    assert result.truncated
+    assert "truncated" in result.output
+
+
+def test_empty_file(videofile):
+    result = find_zero_ranges(videofile)
+    assert not result.success
+    assert result.output == "File is empty"
@@ -6,6 +6,7 @@ from os import unlink, makedirs, statvfs, stat
 from threading import Lock
 import logging
 from videofilecheck.lib.util import SubBar
+from videofilecheck.lib.throttle import throttled_read, READ_CHUNK
 log = logging.getLogger(__name__)
 
 
@@ -62,6 +63,11 @@ CACHEDIRS = [
 ]
 
 
+def is_cached(path: str) -> bool:
+    """True if path is located in one of the cache locations"""
+    return any(path.startswith(cachedir.path) for cachedir in CACHEDIRS)
+
+
 class UnCachedFile:
     """Same interface as CachedFile without actually doing the caching"""
 
@@ -107,7 +113,7 @@ class CachedFile:
 
     def __exit__(self, *exc):
         if self._cached is not None and self.do_delete:
-            assert any(self._cached.startswith(cachedir.path) for cachedir in CACHEDIRS)
+            assert is_cached(self._cached)
             unlink(self._cached)
             log.debug("Deleting %s" % self._cached)
 
@@ -133,7 +139,7 @@ class CachedFile:
         log.debug("Caching %s to %s" % (self.original, dst))
         with open(self.original, "rb") as fsrc, open(dst, "wb") as fdst, SubBar(fsrc, self.bar, "cache", "b") as _bar:
             while True:
-                chunk = fsrc.read(8192)
+                chunk = throttled_read(fsrc, READ_CHUNK)
 
                 if not chunk:
                     break
@@ -3,16 +3,88 @@
 import logging
 import hashlib
 from videofilecheck.lib.util import SubBar
+from videofilecheck.lib.cache import is_cached
+from videofilecheck.lib.throttle import throttled_read, READ_CHUNK
 log = logging.getLogger(__name__)
 
+# Size of the blocks that are hashed individually to find the changed parts of a file
+BLOCKSIZE = 16 * 1024 * 1024
 
-def checksum(file, bar, algorithm=hashlib.md5):
+# Bytes of each block digest that are stored, 8 bytes are plenty to detect changes of a block
+BLOCK_DIGEST_SIZE = 8
+
+
+class BlockHashes:
+    """
+    Hashes of the fixed-size blocks of a file and the root of the merkle tree built from them.
+    Stored compactly in the database as a single hex string of concatenated (truncated) block digests.
+    """
+
+    def __init__(self, blocks: str, blocksize: int = BLOCKSIZE, algorithm=hashlib.md5):
+        self.blocks = blocks
+        self.blocksize = blocksize
+        self.algorithm = algorithm
+
+    @property
+    def digests(self) -> list:
+        n = 2 * BLOCK_DIGEST_SIZE
+        return [self.blocks[i:i + n] for i in range(0, len(self.blocks), n)]
+
+    @property
+    def root(self) -> str:
+        level = [bytes.fromhex(d) for d in self.digests]
+        if not level:
+            return self.algorithm().hexdigest()
+
+        while len(level) > 1:
+            pairs = [level[i:i + 2] for i in range(0, len(level), 2)]
+            level = [self.algorithm(b"".join(pair)).digest() for pair in pairs]
+
+        return level[0].hex()
+
+    def changed(self, other) -> list:
+        """Indices of the blocks that differ from other, None if the files cannot be compared blockwise"""
+        if other is None or other.blocksize != self.blocksize or len(other.blocks) != len(self.blocks):
+            return None
+
+        if other.root == self.root:
+            return []
+
+        return [i for i, (a, b) in enumerate(zip(self.digests, other.digests)) if a != b]
+
+    def byte_ranges(self, indices: list, filesize: int) -> list:
+        """Merge the given block indices to (start, end) byte ranges"""
+        ranges = []
+        for i in sorted(indices):
+            start, end = i * self.blocksize, min((i + 1) * self.blocksize, filesize)
+            if ranges and ranges[-1][1] == start:
+                ranges[-1] = (ranges[-1][0], end)
+            else:
+                ranges.append((start, end))
+        return ranges
+
+    def __str__(self):
+        return "BlockHashes(blocks=%d, root=%s)" % (len(self.digests), self.root)
+
+    def __repr__(self):
+        return str(self)
+
+
+def block_checksum(file, bar, algorithm=hashlib.md5, blocksize=BLOCKSIZE):
+    """Hash of the whole file and its BlockHashes (None if blocksize is None), calculated in one pass"""
     file_hash = algorithm()
     log.debug("Calculating hash of %s using algorithm %s" % (file, file_hash.name))
 
+    block_hash = algorithm()
+    block_fill = 0
+    blocks = []
+
+    # Reading from the cache does not touch the disk that holds the library
+    read = (lambda f, size: f.read(size)) if is_cached(file) else throttled_read
+
     with open(file, "rb") as f, SubBar(f, bar, file_hash.name, "b") as _bar:
         while True:
-            chunk = f.read(8192)
+            chunk = read(f, READ_CHUNK)
 
             if not chunk:
                 break
@@ -20,6 +92,28 @@ def checksum(file, bar, algorithm=hashlib.md5):
             _bar.update(len(chunk))
             file_hash.update(chunk)
 
+            while blocksize is not None and chunk:
+                part = chunk[:blocksize - block_fill]
+                chunk = chunk[len(part):]
+                block_hash.update(part)
+                block_fill += len(part)
+
+                if block_fill == blocksize:
+                    blocks.append(block_hash.hexdigest()[:2 * BLOCK_DIGEST_SIZE])
+                    block_hash = algorithm()
+                    block_fill = 0
+
+    if block_fill > 0:
+        blocks.append(block_hash.hexdigest()[:2 * BLOCK_DIGEST_SIZE])
+
     hexdigest = file_hash.hexdigest()
     log.debug("Hash of %s is %s" % (file, hexdigest))
-    return hexdigest
+
+    if blocksize is None:
+        return hexdigest, None
+
+    return hexdigest, BlockHashes("".join(blocks), blocksize, algorithm)
+
+
+def checksum(file, bar, algorithm=hashlib.md5):
+    return block_checksum(file, bar, algorithm, blocksize=None)[0]
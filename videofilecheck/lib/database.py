@@ -1,6 +1,7 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 import json
+from copy import deepcopy
 from os.path import exists
 import tempfile
 from shutil import move
@@ -9,7 +10,10 @@ import logging
 
 log = logging.getLogger(__name__)
 
-DEFAULT_CONTENT = {"files": {}}
+# Per-file results that are only valid as long as size and mtime of the file are unchanged
+CACHE_TABLES = ["zeroes", "probes"]
+
+DEFAULT_CONTENT = {"files": {}, "zeroes": {}, "probes": {}}
 
 
 def locked(func):
@@ -30,9 +34,13 @@ class Database:
             with open(self.dbpath, "rt", encoding="utf-8") as f:
                 self.data = json.load(f)
                 log.debug("Loading existing database with %s entries" % len(self.data["files"].keys()))
+
+            # Migration: older databases do not have all caches
+            for table in CACHE_TABLES:
+                self.data.setdefault(table, {})
         else:
             log.info("Creating new database")
-            self.data = DEFAULT_CONTENT
+            self.data = deepcopy(DEFAULT_CONTENT)
             self.flush()
 
     @locked
@@ -80,7 +88,67 @@ class Database:
     @locked
     def delete(self, videofile):
         del self.data["files"][videofile]
+        for table in CACHE_TABLES:
+            self.data[table].pop(videofile, None)
+
+    @locked
+    def rename(self, videofile, new_videofile):
+        """Move the entry and all cached results of videofile to a new key"""
+        for table in ["files", *CACHE_TABLES]:
+            if videofile in self.data[table]:
+                entry = self.data[table].pop(videofile)
+                entry["videofile"] = new_videofile
+                self.data[table][new_videofile] = entry
 
     @locked
     def get_all(self):
         return self.data["files"].items()
+
+    @locked
+    def get_entry(self, videofile):
+        return self.data["files"].get(videofile)
+
+    def find(self, predicate=None):
+        """
+        Iterate over all entries matching predicate, in database order.
+        Does not copy the entries, so the database must not be modified while iterating.
+        """
+        for entry in self.data["files"].values():
+            if predicate is None or predicate(entry):
+                yield entry
+
+    def _get_cached(self, table, videofile, filesize, mtime):
+        if videofile not in self.data[table]:
+            return None
+
+        entry = self.data[table][videofile]
+
+        if filesize is None and mtime is None:
+            return entry
+
+        if entry["filesize"] != filesize or entry["mtime"] != mtime:
+            log.debug("Cached %s of %s is outdated" % (table, videofile))
+            return None
+
+        return entry
+
+    @locked
+    def set_zeroes(self, entry):
+        self.data["zeroes"][entry["videofile"]] = entry
+
+    @locked
+    def get_zeroes(self, videofile, filesize, mtime):
+        """Cached zero scan result of videofile, None if there is none or the file changed since"""
+        return self._get_cached("zeroes", videofile, filesize, mtime)
+
+    @locked
+    def set_probe(self, entry):
+        self.data["probes"][entry["videofile"]] = entry
+
+    @locked
+    def get_probe(self, videofile, filesize, mtime):
+        """
+        Cached ffprobe metadata of videofile, None if there is none or the file changed since.
+        Without filesize and mtime, the (possibly outdated) metadata is returned without checking
+        """
+        return self._get_cached("probes", videofile, filesize, mtime)
@@ -1,32 +1,173 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
-from time import sleep
 import subprocess
 import logging
+import json
 import os.path
-from os import unlink
+from bisect import bisect_left, bisect_right
+from os import unlink, cpu_count
+from functools import lru_cache
 import shutil
 from videofilecheck.lib.util import SubBar
-from threading import Thread, Event
+from videofilecheck.lib.cache import is_cached
+from videofilecheck.lib.throttle import throttled_read, READ_CHUNK
+from videofilecheck.lib.supervisor import SUPERVISOR
 
 log = logging.getLogger(__name__)
 
 
 IGNORE_THESE_ERRORS = ["Application provided invalid, non monotonically increasing dts to muxer"]
 
+# Which streams are decoded: ffmpeg's default selection (one video, one audio stream), all audio and video streams
+# or only the video streams (skipping audio decoding, attached pictures like cover art are ignored as well)
+MODES = {
+    "default": [],
+    "all": ["-map", "0:v?", "-map", "0:a?"],
+    "video": ["-map", "0:V?", "-an", "-sn", "-dn"],
+}
+
+# Decoder threads per ffmpeg process by maximum video height, several files are decoded in parallel anyway
+THREADS = [(576, 1), (720, 2), (1080, 4), (None, 8)]
+
+# Faster software decoders that are used instead of ffmpeg's default decoder if they are available
+FAST_DECODERS = {"av1": "libdav1d"}
+
+# Reference for the decoding cost: one second of 1080p video
+REFERENCE_PIXELS = 1920 * 1080
+
+# Seconds decoded after the last packet of a changed region if there is no keyframe after it
+RANGE_MARGIN = 2.0
+
 
 class Result:
-    def __init__(self, output: str):
+    def __init__(self, output: str, timeout: bool = False):
         self.output = output
-        self.success = len(output) == 0
+        self.timeout = timeout
+        self.success = len(output) == 0 and not timeout
 
     def __str__(self):
-        return "Result(success=%s, output=%s)" % (self.success, self.output)
+        return "Result(success=%s, timeout=%s, output=%s)" % (self.success, self.timeout, self.output)
 
     def __repr__(self):
         return str(self)
 
 
+class Metadata:
+    """Summary of the ffprobe output of a file, info is the (JSON serializable) dict stored in the database"""
+
+    def __init__(self, info: dict):
+        self.info = info
+        self.duration = info.get("duration")
+        self.bitrate = info.get("bitrate")
+        self.streams = info.get("streams", [])
+
+    @classmethod
+    def from_ffprobe(cls, probe: dict):
+        fmt = probe.get("format", {})
+        streams = []
+
+        for stream in probe.get("streams", []):
+            streams.append(dict(
+                index=stream.get("index"),
+                type=stream.get("codec_type"),
+                codec=stream.get("codec_name"),
+                width=stream.get("width"),
+                height=stream.get("height"),
+                attached_pic=stream.get("disposition", {}).get("attached_pic", 0) == 1,
+            ))
+
+        return cls(dict(duration=_to_number(fmt.get("duration"), float), bitrate=_to_number(fmt.get("bit_rate"), int),
+                        streams=streams))
+
+    @property
+    def video(self) -> list:
+        return [s for s in self.streams if s["type"] == "video" and not s.get("attached_pic")]
+
+    @property
+    def audio(self) -> list:
+        return [s for s in self.streams if s["type"] == "audio"]
+
+    @property
+    def height(self):
+        return max([s["height"] or 0 for s in self.video], default=0)
+
+    @property
+    def pixels(self):
+        return max([(s["width"] or 0) * (s["height"] or 0) for s in self.video], default=0)
+
+    @property
+    def cost(self):
+        """Estimated decoding work in seconds of 1080p video, None if the duration is unknown"""
+        if self.duration is None:
+            return None
+        return self.duration * max(self.pixels, 1) / REFERENCE_PIXELS
+
+    def __str__(self):
+        return "Metadata(duration=%s, bitrate=%s, streams=%s)" % (self.duration, self.bitrate, self.streams)
+
+    def __repr__(self):
+        return str(self)
+
+
+def _to_number(value, conv):
+    try:
+        return conv(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def ffprobe(videofile: str) -> Metadata:
+    """Read the container and stream metadata of videofile. Raises on errors"""
+    log.debug('Running ffprobe for "%s"' % videofile)
+    ffprobe_call = ["ffprobe", "-v", "error", "-print_format", "json", "-show_format", "-show_streams", videofile]
+    output = subprocess.check_output(ffprobe_call, stderr=subprocess.DEVNULL)
+    return Metadata.from_ffprobe(json.loads(output.decode("utf-8")))
+
+
+@lru_cache(maxsize=None)
+def available_decoders() -> frozenset:
+    try:
+        output = subprocess.check_output(["ffmpeg", "-hide_banner", "-decoders"], stderr=subprocess.DEVNULL)
+    except (OSError, subprocess.CalledProcessError) as e:
+        log.warning("Cannot list ffmpeg decoders: %s" % e)
+        return frozenset()
+
+    # Lines look like " V....D libdav1d             dav1d AV1 decoder by VideoLAN"
+    decoders = set()
+    for line in output.decode("utf-8", "replace").splitlines():
+        parts = line.split()
+        if len(parts) >= 2 and len(parts[0]) == 6 and parts[0] != "------":
+            decoders.add(parts[1])
+
+    return frozenset(decoders)
+
+
+def decode_options(metadata: Metadata = None, mode: str = "default", decoders=None) -> tuple:
+    """ffmpeg (input options, output options) to decode a file with the given metadata in the given mode"""
+    input_options = []
+    output_options = list(MODES[mode])
+
+    if metadata is None:
+        return input_options, output_options
+
+    if metadata.video:
+        height = metadata.height
+        threads = next(n for limit, n in THREADS if limit is None or height <= limit)
+        input_options += ["-threads", str(min(threads, cpu_count() or 1))]
+
+        codecs = set(s["codec"] for s in metadata.video)
+        if len(codecs) == 1:
+            fast = FAST_DECODERS.get(codecs.pop())
+            if fast is not None and fast in (available_decoders() if decoders is None else decoders):
+                input_options += ["-c:v", fast]
+
+    if mode == "video" and not metadata.video:
+        # Nothing to decode in video mode, check the audio instead of failing on an empty map
+        output_options = list(MODES["default"])
+
+    return input_options, output_options
+
+
 def ignore_line(data: str) -> bool:
     for poison in IGNORE_THESE_ERRORS:
         if poison in data:
@@ -48,62 +189,163 @@ def remove_ignored_stuff(data: str) -> str:
     return "\n".join(wanted_output)
 
 
-def watchdog(f, proc, done):
+def ffmpeg_scan(videofile: str, bar=None, options=([], [])) -> Result:
+    """Decode videofile, options are the (input options, output options) from decode_options()"""
+    job = None
     try:
-        stuck_counter = 0
-        previous_progress = 0
-        while not done.is_set():
-            sleep(1)
-            if f.tell() == previous_progress:
-                stuck_counter += 1
+        input_options, output_options = options
+        ffmpeg_call = ["ffmpeg", "-loglevel", "error", "-nostats", "-progress", "pipe:1", *input_options, "-i", "-",
+                       *output_options, "-max_muxing_queue_size", "1800", "-f", "null", "-"]
+        log.debug('Running ffmpeg for "%s": %s' % (videofile, " ".join(ffmpeg_call)))
 
-            if stuck_counter > 5:
-                log.error("Killing stuck process")
-                proc.terminate()
+        read = (lambda f, size: f.read(size)) if is_cached(videofile) else throttled_read
 
-            previous_progress = f.tell()
-    except ValueError:
-        return
+        with open(videofile, "rb") as f, SubBar(f, bar, "ffmpeg", "b") as _bar:
+            proc = subprocess.Popen(ffmpeg_call, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            job = SUPERVISOR.watch(proc, videofile)
 
+            try:
+                while True:
+                    chunk = read(f, READ_CHUNK)
 
-def ffmpeg_scan(videofile: str, bar=None) -> Result:
+                    if not chunk:
+                        break
+
+                    job.write(chunk)
+
+                    _bar.update(len(chunk))
+                    _bar.refresh()
+            except BrokenPipeError:
+                log.debug("ffmpeg stopped reading %s" % videofile)
+            finally:
+                job.close_input()
+
+        job.done.wait()
+        proc.wait()
+        output = job.output.decode("utf-8", "replace")
+        output = remove_ignored_stuff(output)
+        output = output.strip()
+    except Exception as e:
+        output = str(e)
+
+    return _result(job, output)
+
+
+def _result(job, output) -> Result:
+    if job is not None and job.killed is not None:
+        return Result("\n".join(filter(None, ["Timeout: " + job.killed, output])), timeout=True)
+
+    # If the error-string length is 0, there are no errors
+    return Result(output)
+
+
+def header_check(videofile: str) -> Result:
+    """Check that the container header and stream headers of videofile can be read without errors"""
     try:
-        log.debug('Running ffmpeg for "%s"' % videofile)
-        ffmpeg_call = ["ffmpeg", "-loglevel", "error", "-i", "-", "-max_muxing_queue_size", "1800", "-f", "null", "-"]
+        ffprobe_call = ["ffprobe", "-v", "error", "-show_format", "-show_streams", videofile]
+        proc = subprocess.run(ffprobe_call, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        output = remove_ignored_stuff(proc.stderr.decode("utf-8", "replace")).strip()
+        if proc.returncode != 0 and not output:
+            output = "ffprobe failed with exit code %d" % proc.returncode
+    except Exception as e:
+        output = str(e)
 
-        with open(videofile, "rb") as f, SubBar(f, bar, "ffmpeg", "b") as _bar:
-            proc = subprocess.Popen(ffmpeg_call, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    return Result(output)
+
+
+def packet_index(videofile: str) -> list:
+    """(byte position, timestamp, stream index, keyframe) of all packets of videofile, sorted by position"""
+    log.debug('Reading packet index of "%s"' % videofile)
+    ffprobe_call = ["ffprobe", "-v", "error", "-show_entries", "packet=stream_index,pts_time,dts_time,pos,flags",
+                    "-of", "compact=p=0", videofile]
+    output = subprocess.check_output(ffprobe_call, stderr=subprocess.DEVNULL)
+
+    packets = []
+    for line in output.decode("utf-8", "replace").splitlines():
+        fields = dict(field.partition("=")[::2] for field in line.split("|"))
+        pos = _to_number(fields.get("pos"), int)
+        time = _to_number(fields.get("pts_time"), float)
+        if time is None:
+            time = _to_number(fields.get("dts_time"), float)
+        if pos is None or time is None:
+            continue
+        packets.append((pos, time, _to_number(fields.get("stream_index"), int), "K" in fields.get("flags", "")))
+
+    packets.sort()
+    return packets
+
+
+def time_ranges(packets: list, byte_ranges: list, video_streams=None) -> list:
+    """
+    Map (start, end) byte ranges of a file to the (start, end) time ranges that have to be decoded to check them,
+    using the packet index. Ranges start at the keyframe before the first packet that overlaps the byte range
+    and end at the keyframe after its last packet. An end of None means until the end of the file.
+    Byte ranges without any packets (e.g. only container metadata) result in no time range.
+    """
+    positions = [p[0] for p in packets]
+    keyframes = sorted(t for _, t, stream, key in packets if key and (video_streams is None or stream in video_streams))
+
+    ranges = []
+    for start, end in byte_ranges:
+        # include the packet that starts before the range, it may extend into it
+        lo = max(0, bisect_left(positions, start) - 1)
+        hi = bisect_left(positions, end)
+        times = [p[1] for p in packets[lo:hi]]
+
+        if not times:
+            continue
 
-            done = Event()
-            t = Thread(target=watchdog, args=(f, proc, done))
-            t.start()
+        i = bisect_right(keyframes, min(times)) - 1
+        t_start = keyframes[i] if i >= 0 else 0.0
 
-            while True:
-                chunk = f.read(32 * 1024)
+        i = bisect_right(keyframes, max(times))
+        t_end = keyframes[i] if i < len(keyframes) else None
+        if t_end is None and not keyframes:
+            t_end = max(times) + RANGE_MARGIN
 
-                if not chunk:
-                    break
+        ranges.append((t_start, t_end))
 
-                proc.stdin.write(chunk)
+    ranges.sort(key=lambda r: r[0])
+    merged = []
+    for t_start, t_end in ranges:
+        if merged and (merged[-1][1] is None or t_start <= merged[-1][1]):
+            prev_start, prev_end = merged[-1]
+            merged[-1] = (prev_start, None if prev_end is None or t_end is None else max(prev_end, t_end))
+        else:
+            merged.append((t_start, t_end))
 
-                _bar.update(len(chunk))
-                _bar.refresh()
+    return merged
 
-            done.set()
-            t.join()
 
-        output, _ = proc.communicate()
-        output = output.decode("utf-8")
+def ffmpeg_scan_range(videofile: str, start: float, end=None, options=([], [])) -> Result:
+    """
+    Decode videofile from start to end (seconds, None for the end of the file). Needs a seekable file.
+    start and end are timestamps like the ones of packet_index(), they are not offset by the start time of the file,
+    which is not 0 for e.g. transport streams and files remuxed from them.
+    """
+    job = None
+    try:
+        input_options, output_options = options
+        duration = ["-t", "%.3f" % (end - start)] if end is not None else []
+        ffmpeg_call = ["ffmpeg", "-loglevel", "error", "-nostats", "-progress", "pipe:1", *input_options,
+                       "-seek_timestamp", "1", "-ss", "%.3f" % start, "-i", videofile, *duration, *output_options,
+                       "-max_muxing_queue_size", "1800", "-f", "null", "-"]
+        log.debug('Running ffmpeg for "%s": %s' % (videofile, " ".join(ffmpeg_call)))
+
+        proc = subprocess.Popen(ffmpeg_call, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        job = SUPERVISOR.watch(proc, videofile)
+        # ffmpeg reads the file itself, the input is always available
+        job.close_input()
+
+        job.done.wait()
+        proc.wait()
+        output = job.output.decode("utf-8", "replace")
         output = remove_ignored_stuff(output)
         output = output.strip()
     except Exception as e:
         output = str(e)
 
-    if t and t.is_alive():
-        t.join()
-
-    # If the error-string length is 0, there are no errors
-    return Result(output)
+    return _result(job, output)
 
 
 def ffmpeg_remux(file: str):
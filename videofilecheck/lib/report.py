@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from abc import ABC, abstractmethod
+from datetime import datetime
+import csv
+import json
+import sys
+from videofilecheck.lib.roots import split_key
+import logging
+log = logging.getLogger(__name__)
+
+FORMATS = ["text", "csv", "jsonl"]
+STATUSES = ["all", "ok", "failed", "timeout"]
+
+CSV_FIELDS = ["videofile", "status", "timestamp", "filesize", "output"]
+
+
+def status_name(entry) -> str:
+    if entry["status"]:
+        return "OK"
+    if entry.get("timeout"):
+        return "TIMEOUT"
+    return "FAILED"
+
+
+class Report(ABC):
+    """
+    Write results one entry at a time so the report is usable while a scan is still running.
+    Every entry is flushed right away. The path "-" writes to stdout.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.count = 0
+        if path == "-":
+            self.f = sys.stdout
+        else:
+            self.f = open(path, "wt", encoding="utf-8", newline="")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        if self.f is not sys.stdout:
+            self.f.close()
+
+    def write(self, entry):
+        self._write(entry)
+        self.count += 1
+        self.f.flush()
+
+    @abstractmethod
+    def _write(self, entry):
+        """Write a single entry to self.f"""
+
+    def __str__(self):
+        return "%s(path=%s)" % (type(self).__name__, self.path)
+
+    def __repr__(self):
+        return str(self)
+
+
+class TextReport(Report):
+    """Human readable, one line per file followed by the error output of failed files"""
+
+    def _write(self, entry):
+        self.f.write("%s %s\n" % (status_name(entry).center(6), entry["videofile"]))
+
+        if not entry["status"]:
+            for l in entry.get("output", "").splitlines():
+                self.f.write("> %s\n" % l)
+
+
+class CsvReport(Report):
+    def __init__(self, path: str):
+        super().__init__(path)
+        self.writer = csv.DictWriter(self.f, CSV_FIELDS, extrasaction="ignore")
+        self.writer.writeheader()
+
+    def _write(self, entry):
+        row = dict(entry)
+        row["status"] = status_name(entry)
+        self.writer.writerow(row)
+
+
+class JsonLinesReport(Report):
+    """One JSON object (the database entry) per line"""
+
+    def _write(self, entry):
+        self.f.write(json.dumps(entry) + "\n")
+
+
+REPORTS = {"text": TextReport, "csv": CsvReport, "jsonl": JsonLinesReport}
+
+
+def open_report(path: str, fmt: str = None) -> Report:
+    """Create a report for path, the format is guessed from the file extension if fmt is None"""
+    if fmt is None:
+        if path.endswith(".csv"):
+            fmt = "csv"
+        elif path.endswith(".jsonl") or path.endswith(".json"):
+            fmt = "jsonl"
+        else:
+            fmt = "text"
+
+    if fmt not in REPORTS:
+        raise ValueError("Unknown report format %s, use one of %s" % (fmt, ", ".join(FORMATS)))
+
+    log.debug("Writing %s report to %s" % (fmt, path))
+    return REPORTS[fmt](path)
+
+
+def parse_timestamp(value: str) -> int:
+    """Unix timestamp from either a unix timestamp or an ISO date(time) like 2020-01-31 or 2020-01-31T12:00"""
+    try:
+        return int(value)
+    except ValueError:
+        pass
+
+    for fmt in ("%Y-%m-%d", "%Y-%m-%dT%H:%M", "%Y-%m-%d %H:%M", "%Y-%m-%dT%H:%M:%S", "%Y-%m-%d %H:%M:%S"):
+        try:
+            return int(datetime.strptime(value, fmt).timestamp())
+        except ValueError:
+            continue
+
+    raise ValueError("Cannot parse %s as timestamp or date" % value)
+
+
+def entry_filter(status: str = "all", prefix: str = None, since: int = None, error: str = None, before: int = None):
+    """
+    Predicate for database entries, every given criterion has to match.
+    The prefix is compared to the path of the file within its filesystem, without the filesystem id of the key.
+    """
+    if status not in STATUSES:
+        raise ValueError("Unknown status %s, use one of %s" % (status, ", ".join(STATUSES)))
+
+    def _match(entry) -> bool:
+        if status == "ok" and not entry["status"]:
+            return False
+        if status == "failed" and entry["status"]:
+            return False
+        if status == "timeout" and not entry.get("timeout"):
+            return False
+        if prefix is not None and not split_key(entry["videofile"])[1].startswith(prefix):
+            return False
+        if since is not None and entry.get("timestamp", 0) < since:
+            return False
+        if before is not None and entry.get("timestamp", 0) >= before:
+            return False
+        if error is not None and error not in entry.get("output", ""):
+            return False
+        return True
+
+    return _match
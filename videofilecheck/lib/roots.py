@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from os import listdir
+from os.path import join, abspath, expanduser, realpath, relpath, normpath, isdir, ismount, dirname
+import re
+import logging
+log = logging.getLogger(__name__)
+
+MOUNTINFO = "/proc/self/mountinfo"
+DEVDIR = "/dev/disk"
+
+
+def _unescape(field: str) -> str:
+    """mountinfo escapes spaces, tabs, newlines and backslashes as octal, e.g. \\040"""
+    return re.sub(r"\\([0-7]{3})", lambda m: chr(int(m.group(1), 8)), field)
+
+
+def find_mount(path: str, mountinfo: str = MOUNTINFO) -> tuple:
+    """(mountpoint, root of the mount within its filesystem, source) of the filesystem that contains path"""
+    best = None
+
+    try:
+        with open(mountinfo, "rt") as f:
+            for line in f:
+                fields, _, fs_fields = line.partition(" - ")
+                fields, fs_fields = fields.split(), fs_fields.split()
+                if len(fields) < 5 or len(fs_fields) < 2:
+                    continue
+
+                fs_root, mountpoint, source = _unescape(fields[3]), _unescape(fields[4]), _unescape(fs_fields[1])
+                if path != mountpoint and not path.startswith(mountpoint.rstrip("/") + "/"):
+                    continue
+
+                # later mounts on the same mountpoint hide the earlier ones
+                if best is None or len(mountpoint) >= len(best[0]):
+                    best = (mountpoint, fs_root, source)
+    except OSError:
+        log.debug("Cannot read %s, falling back to the mountpoint as filesystem id" % mountinfo)
+
+    if best is not None:
+        return best
+
+    mountpoint = path
+    while not ismount(mountpoint) and dirname(mountpoint) != mountpoint:
+        mountpoint = dirname(mountpoint)
+    return mountpoint, "/", None
+
+
+def filesystem_id(source: str, mountpoint: str, devdir: str = DEVDIR) -> str:
+    """
+    Stable id of a filesystem that does not depend on where it is mounted:
+    - block devices: the filesystem UUID or label (or the device path if neither is known)
+    - network filesystems and datasets (server:/export, //server/share, pool/dataset): the source
+    - everything else (tmpfs, overlay, ...): source and mountpoint
+    """
+    if source is not None and source.startswith("/dev/"):
+        device = realpath(source)
+        for kind in ("by-uuid", "by-label"):
+            links = join(devdir, kind)
+            if not isdir(links):
+                continue
+            for name in sorted(listdir(links)):
+                if realpath(join(links, name)) == device:
+                    # udev escapes special characters in labels, e.g. spaces as \x20
+                    return re.sub(r"\\x([0-9a-fA-F]{2})", lambda m: chr(int(m.group(1), 16)), name)
+
+        return source
+
+    if source is not None and (":" in source or source.startswith("//") or "/" in source):
+        return source
+
+    return "%s@%s" % (source or "fs", mountpoint)
+
+
+class Root:
+    """
+    A directory that is scanned recursively. Database keys of its files are "<filesystem id>:<path within the
+    filesystem>", so they do not change when the filesystem is mounted somewhere else and files of different
+    roots never clash.
+    """
+
+    def __init__(self, path: str, mountinfo: str = MOUNTINFO, devdir: str = DEVDIR):
+        self.path = realpath(abspath(expanduser(path)))
+        self.mountpoint, fs_root, source = find_mount(self.path, mountinfo)
+        self.id = filesystem_id(source, self.mountpoint, devdir)
+
+        # path of the root directory within the filesystem, "" for the top directory
+        base = normpath(join(fs_root, relpath(self.path, self.mountpoint))).strip("/")
+        self.base = "" if base == "." else base
+
+    def key(self, rel: str) -> str:
+        """Database key of rel, a path relative to the root directory"""
+        return "%s:%s" % (self.id, normpath(join(self.base, rel)))
+
+    def key_prefix(self, prefix: str = "") -> str:
+        """Common prefix of the keys of all files whose path relative to the root directory starts with prefix"""
+        rel = normpath(prefix) if prefix else "."
+        if rel == ".":
+            return "%s:%s" % (self.id, self.base + "/" if self.base else "")
+
+        return self.key(rel) + ("/" if prefix.endswith("/") else "")
+
+    def owns(self, key: str) -> bool:
+        """True if key belongs to a file in this root directory"""
+        return key.startswith(self.key_prefix())
+
+    def path_of(self, key: str) -> str:
+        """Absolute path of the file with the given key, which has to be owned by this root"""
+        rel = key[len(self.id) + 1:]
+        return join(self.path, relpath(rel, self.base) if self.base else rel)
+
+    def __str__(self):
+        return "Root(path=%s, id=%s, base=%s)" % (self.path, self.id, self.base)
+
+    def __repr__(self):
+        return str(self)
+
+
+def split_key(key: str) -> tuple:
+    """
+    (filesystem id, path within the filesystem) of a database key, the id is "" for keys of older databases.
+    Ids of network filesystems contain colons themselves (nas:/export, [fe80::1]:/export, user@host:), but these are
+    always followed by a slash or another colon or are enclosed in brackets, while paths never start with either.
+    """
+    depth = 0
+    for i, c in enumerate(key):
+        if c == "[":
+            depth += 1
+        elif c == "]":
+            depth = max(0, depth - 1)
+        elif c == ":" and depth == 0 and not key.startswith(("/", ":"), i + 1):
+            return key[:i], key[i + 1:]
+
+    return "", key
+
+
+def read_roots_file(path: str) -> list:
+    """Directories listed in a file, one per line. Empty lines and lines starting with # are ignored"""
+    with open(expanduser(path), "rt", encoding="utf-8") as f:
+        lines = [line.strip() for line in f]
+
+    return [line for line in lines if line and not line.startswith("#")]
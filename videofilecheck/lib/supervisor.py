@@ -0,0 +1,229 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from time import monotonic
+from threading import Thread, Lock, Event
+import selectors
+import os
+import logging
+log = logging.getLogger(__name__)
+
+# Never kill a process that made progress in the last MIN_STALL_TIMEOUT seconds
+MIN_STALL_TIMEOUT = 10.0
+
+# A process is stuck once it made no progress for STALL_FACTOR times its usual time between progress updates
+STALL_FACTOR = 10.0
+
+# Files with a higher bitrate (bit/s) get a proportionally longer timeout
+REFERENCE_BITRATE = 10 * 1000 * 1000
+
+
+class Job:
+    """
+    A running ffmpeg process that reports its decoding progress (-progress pipe:1) on stdout.
+    The feeding thread writes the input using write() so the supervisor knows whether ffmpeg is
+    waiting for input (slow source, not its fault) or not consuming the input (stuck).
+    """
+
+    def __init__(self, proc, name):
+        self.proc = proc
+        self.name = name
+        self.output = bytearray()
+        self.progress = bytearray()
+        self.progress_values = {}
+        self.out_time = 0
+        self.frame = 0
+        self.fed = 0
+        self.last_progress = monotonic()
+        self.avg_gap = None
+        self.blocked_since = None
+        self.input_closed = None
+        self.killed = None
+        self.open_fds = 0
+        self.done = Event()
+
+    def write(self, chunk):
+        self.blocked_since = monotonic()
+        try:
+            self.proc.stdin.write(chunk)
+        finally:
+            self.blocked_since = None
+        self.fed += len(chunk)
+
+    def close_input(self):
+        self.input_closed = monotonic()
+        try:
+            self.proc.stdin.close()
+        except BrokenPipeError:
+            pass
+
+    def parse_progress(self, data):
+        """Parse the key=value lines of ffmpeg -progress, each block ends with a progress=... line"""
+        self.progress += data
+        *lines, rest = self.progress.split(b"\n")
+        self.progress = bytearray(rest)
+
+        for line in lines:
+            key, _, value = line.decode("utf-8", "replace").strip().partition("=")
+            self.progress_values[key] = value
+
+            if key == "progress":
+                self._update_progress()
+
+    def _update_progress(self):
+        try:
+            out_time = int(self.progress_values.get("out_time_us", "0"))
+        except ValueError:
+            out_time = self.out_time
+
+        try:
+            frame = int(self.progress_values.get("frame", "0"))
+        except ValueError:
+            frame = self.frame
+
+        if out_time > self.out_time or frame > self.frame:
+            now = monotonic()
+            gap = now - self.last_progress
+            self.avg_gap = gap if self.avg_gap is None else 0.9 * self.avg_gap + 0.1 * gap
+            self.last_progress = now
+            self.out_time = max(out_time, self.out_time)
+            self.frame = max(frame, self.frame)
+
+    @property
+    def speed(self):
+        """Decoding speed relative to realtime as reported by ffmpeg, None if unknown"""
+        value = self.progress_values.get("speed", "").rstrip("x").strip()
+        try:
+            return float(value)
+        except ValueError:
+            return None
+
+    @property
+    def bitrate(self):
+        if self.out_time <= 0:
+            return None
+        return 8 * self.fed / (self.out_time / 1000000)
+
+    def stall_timeout(self, min_timeout=MIN_STALL_TIMEOUT):
+        timeout = min_timeout
+
+        if self.avg_gap is not None:
+            timeout = max(timeout, STALL_FACTOR * self.avg_gap)
+
+        bitrate = self.bitrate
+        if bitrate is not None and bitrate > REFERENCE_BITRATE:
+            timeout *= bitrate / REFERENCE_BITRATE
+
+        return timeout
+
+    def stalled_for(self, now):
+        """Seconds ffmpeg did not make progress although it could have, None if it is waiting for input"""
+        if self.input_closed is not None:
+            return now - max(self.last_progress, self.input_closed)
+
+        blocked_since = self.blocked_since
+        if blocked_since is not None:
+            return now - max(self.last_progress, blocked_since)
+
+        return None
+
+    def __str__(self):
+        return "Job(name=%s, frame=%s, out_time=%s, killed=%s)" % (self.name, self.frame, self.out_time, self.killed)
+
+    def __repr__(self):
+        return str(self)
+
+
+class Supervisor:
+    """
+    Single thread that watches all running ffmpeg processes:
+    - collects their error output and progress reports
+    - kills processes that stop decoding although input is available
+    """
+
+    def __init__(self, min_stall_timeout=MIN_STALL_TIMEOUT, interval=0.5):
+        self.min_stall_timeout = min_stall_timeout
+        self.interval = interval
+        self.selector = selectors.DefaultSelector()
+        self.lock = Lock()
+        self.jobs = []
+        self.thread = None
+
+    def watch(self, proc, name):
+        """Start supervising proc, which has to be started with stdout (progress) and stderr (errors) as pipes"""
+        job = Job(proc, name)
+
+        with self.lock:
+            for fileobj in (proc.stdout, proc.stderr):
+                os.set_blocking(fileobj.fileno(), False)
+                self.selector.register(fileobj, selectors.EVENT_READ, job)
+                job.open_fds += 1
+            self.jobs.append(job)
+
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = Thread(target=self.run, name="ffmpeg-supervisor", daemon=True)
+                self.thread.start()
+
+        return job
+
+    def total_speed(self):
+        """Sum of the decoding speeds of all running processes, None if none of them reported a speed yet"""
+        with self.lock:
+            speeds = [job.speed for job in self.jobs if job.speed is not None]
+        return sum(speeds) if speeds else None
+
+    def run(self):
+        while True:
+            with self.lock:
+                if not self.jobs:
+                    self.thread = None
+                    return
+                has_fds = len(self.selector.get_map()) > 0
+
+            events = self.selector.select(self.interval) if has_fds else []
+
+            for key, _ in events:
+                self._read(key.fileobj, key.data)
+
+            self._check_stalls()
+
+    def _read(self, fileobj, job):
+        try:
+            data = os.read(fileobj.fileno(), 65536)
+        except BlockingIOError:
+            return
+
+        if data:
+            if fileobj is job.proc.stdout:
+                job.parse_progress(data)
+            else:
+                job.output += data
+            return
+
+        with self.lock:
+            self.selector.unregister(fileobj)
+            fileobj.close()
+            job.open_fds -= 1
+            if job.open_fds == 0:
+                self.jobs.remove(job)
+                job.done.set()
+
+    def _check_stalls(self):
+        now = monotonic()
+
+        with self.lock:
+            jobs = list(self.jobs)
+
+        for job in jobs:
+            if job.killed is not None or job.proc.poll() is not None:
+                continue
+
+            stalled = job.stalled_for(now)
+            timeout = job.stall_timeout(self.min_stall_timeout)
+
+            if stalled is not None and stalled > timeout:
+                job.killed = "No decoding progress for %.0fs (timeout %.0fs) at frame %s" % (stalled, timeout, job.frame)
+                log.error("Killing stuck ffmpeg for %s: %s" % (job.name, job.killed))
+                job.proc.kill()
+
+
+SUPERVISOR = Supervisor()
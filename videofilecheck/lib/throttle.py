@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from time import monotonic, sleep
+from threading import Lock, Condition
+import ctypes
+import ctypes.util
+import platform
+import logging
+log = logging.getLogger(__name__)
+
+# ioprio_set(2) has no wrapper in the python stdlib
+IOPRIO_SET_SYSCALL = {"x86_64": 251, "i386": 289, "i686": 289, "aarch64": 30, "armv7l": 314}
+IOPRIO_WHO_PROCESS = 1
+IOPRIO_CLASS_IDLE = 3
+IOPRIO_CLASS_SHIFT = 13
+
+# Size of the reads from the library disk. Small reads are mostly served from the readahead in microseconds,
+# their latency says nothing about how busy the disk is.
+READ_CHUNK = 1024 * 1024
+
+
+class TokenBucket:
+    """
+    Limit the read rate (bytes per second) of all threads sharing this bucket.
+    Readers may go into debt, the debt is then paid by sleeping outside of the lock so other threads
+    do not have to wait for the lock while one of them sleeps.
+    """
+
+    def __init__(self, rate=None, burst=None):
+        self.lock = Lock()
+        self.set_rate(rate, burst)
+
+    def set_rate(self, rate, burst=None):
+        with self.lock:
+            self.rate = rate
+            self.burst = burst if burst is not None else (rate or 0)
+            self.tokens = self.burst
+            self.last = monotonic()
+
+    def consume(self, n):
+        if not self.rate:
+            return
+
+        with self.lock:
+            now = monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            self.tokens -= n
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+
+        if wait > 0:
+            sleep(wait)
+
+    def __str__(self):
+        return "TokenBucket(rate=%s, burst=%s)" % (self.rate, self.burst)
+
+    def __repr__(self):
+        return str(self)
+
+
+class AdaptiveConcurrency:
+    """
+    ContextManager that limits the number of concurrently active jobs:
+    - readers report their read latency using record()
+    - at the end of every interval, the latency of the interval is a high percentile of the reported latencies,
+      so a few disk stalls are not averaged away by the many fast reads
+    - when that latency exceeds the target, fewer jobs may run at the same time
+    - when it drops well below the target, the limit is raised again up to the maximum
+    Without a target latency, the limit is never reduced. With adjust=False, the latency is only measured and
+    the limit is left to someone else, e.g. a ConcurrencyTuner that uses the latency as one of its inputs.
+    """
+
+    def __init__(self, maximum=1, target_latency=None, interval=2.0, percentile=0.9, adjust=True):
+        self.cond = Condition()
+        self.active = 0
+        self.interval = interval
+        self.percentile = percentile
+        self.configure(maximum, target_latency, adjust)
+
+    def configure(self, maximum, target_latency=None, adjust=True):
+        with self.cond:
+            self.maximum = max(1, maximum)
+            self.limit = self.maximum
+            self.target_latency = target_latency
+            self.adjust = adjust
+            self.latency = None
+            self.samples = []
+            self.last_adjust = monotonic()
+            self.cond.notify_all()
+
+    def set_limit(self, limit):
+        """Set the number of concurrently active jobs (at most the maximum), e.g. by a ConcurrencyTuner"""
+        with self.cond:
+            self.limit = min(max(1, limit), self.maximum)
+            self.cond.notify_all()
+
+    def __enter__(self):
+        with self.cond:
+            while self.active >= self.limit:
+                self.cond.wait()
+            self.active += 1
+        return self
+
+    def __exit__(self, *exc):
+        with self.cond:
+            self.active -= 1
+            self.cond.notify_all()
+
+    def record(self, latency):
+        if self.target_latency is None:
+            return
+
+        with self.cond:
+            self.samples.append(latency)
+
+            now = monotonic()
+            if now - self.last_adjust < self.interval:
+                return
+            self.last_adjust = now
+
+            samples = sorted(self.samples)
+            self.samples = []
+            self.latency = samples[min(len(samples) - 1, int(self.percentile * len(samples)))]
+
+            if not self.adjust:
+                return
+
+            if self.latency > self.target_latency and self.limit > 1:
+                self.limit -= 1
+                log.debug("Read latency %.1fms too high, reducing concurrency to %d" % (1000 * self.latency, self.limit))
+            elif self.latency < self.target_latency / 2 and self.limit < self.maximum:
+                self.limit += 1
+                log.debug("Read latency %.1fms is low, raising concurrency to %d" % (1000 * self.latency, self.limit))
+                self.cond.notify_all()
+
+    def __str__(self):
+        return "AdaptiveConcurrency(limit=%s, maximum=%s, target_latency=%s)" % (self.limit, self.maximum, self.target_latency)
+
+    def __repr__(self):
+        return str(self)
+
+
+READ_LIMIT = TokenBucket()
+CONCURRENCY = AdaptiveConcurrency()
+
+
+def throttled_read(f, size):
+    """f.read(size), limited by READ_LIMIT. The latency of the read is reported to CONCURRENCY"""
+    READ_LIMIT.consume(size)
+    start = monotonic()
+    chunk = f.read(size)
+    CONCURRENCY.record(monotonic() - start)
+    return chunk
+
+
+def throttled_readinto(f, buf):
+    """f.readinto(buf), limited by READ_LIMIT. The latency of the read is reported to CONCURRENCY"""
+    READ_LIMIT.consume(len(buf))
+    start = monotonic()
+    n = f.readinto(buf)
+    CONCURRENCY.record(monotonic() - start)
+    return n
+
+
+def set_idle_io_priority():
+    """
+    Put the calling thread into the idle io scheduling class (like ionice -c 3).
+    Threads and child processes (ffmpeg) started afterwards inherit the io priority.
+    Returns False if this is not supported on the current platform.
+    """
+    nr = IOPRIO_SET_SYSCALL.get(platform.machine())
+    if platform.system() != "Linux" or nr is None:
+        log.warning("Setting the io priority is not supported on %s %s" % (platform.system(), platform.machine()))
+        return False
+
+    libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+    if libc.syscall(nr, IOPRIO_WHO_PROCESS, 0, IOPRIO_CLASS_IDLE << IOPRIO_CLASS_SHIFT) != 0:
+        log.warning("Setting the io priority failed with errno %d" % ctypes.get_errno())
+        return False
+
+    log.debug("Using idle io priority")
+    return True
@@ -0,0 +1,191 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from time import monotonic
+from os import stat, major, minor
+from threading import Thread, Event
+import logging
+log = logging.getLogger(__name__)
+
+# Add a worker while CPU and disks are below LOW_WATERMARK busy, remove one above HIGH_WATERMARK
+LOW_WATERMARK = 0.75
+HIGH_WATERMARK = 0.95
+
+# An additional worker that lowers the total decoding speed by more than this fraction is removed again
+SPEED_TOLERANCE = 0.05
+
+IGNORED_DEVICES = ("loop", "ram", "zram")
+
+
+def devices_of(paths) -> set:
+    """(major, minor) numbers of the devices that hold paths, to find them in /proc/diskstats"""
+    devices = set()
+    for path in paths:
+        dev = stat(path).st_dev
+        devices.add((major(dev), minor(dev)))
+    return devices
+
+
+class SystemSampler:
+    """
+    Utilisation of the CPUs and the busiest disk since the previous sample, from /proc (Linux).
+    If devices ((major, minor) numbers) are given, only these disks are considered, so other programs that
+    use unrelated disks do not shrink the pool. Values that cannot be measured are None.
+    """
+
+    def __init__(self, proc="/proc", devices=None):
+        self.proc = proc
+        self.devices = devices
+        self.last_time = monotonic()
+        self.last_cpu = self._read_cpu()
+        self.last_disks = self._read_disks()
+
+    def _read_cpu(self):
+        try:
+            with open(self.proc + "/stat", "rt") as f:
+                values = [int(v) for v in f.readline().split()[1:]]
+        except (OSError, ValueError):
+            return None
+
+        # user nice system idle iowait irq softirq steal ...: idle and iowait are not busy
+        idle = values[3] + (values[4] if len(values) > 4 else 0)
+        return sum(values[:8]), idle
+
+    def _read_disks(self):
+        disks = {}
+        try:
+            with open(self.proc + "/diskstats", "rt") as f:
+                for line in f:
+                    parts = line.split()
+                    if len(parts) < 13 or parts[2].startswith(IGNORED_DEVICES):
+                        continue
+                    if self.devices is not None and (int(parts[0]), int(parts[1])) not in self.devices:
+                        continue
+                    # sectors read (always 512 bytes) and milliseconds spent doing I/O
+                    disks[parts[2]] = (int(parts[5]), int(parts[12]))
+        except (OSError, ValueError):
+            return None
+
+        return disks
+
+    def sample(self) -> dict:
+        now = monotonic()
+        cpu = self._read_cpu()
+        disks = self._read_disks()
+        elapsed = max(now - self.last_time, 1e-6)
+
+        result = dict(cpu=None, disk=None, disk_busy=None, disk_read=None)
+
+        if cpu is not None and self.last_cpu is not None:
+            total = cpu[0] - self.last_cpu[0]
+            idle = cpu[1] - self.last_cpu[1]
+            if total > 0:
+                result["cpu"] = 1 - float(idle) / total
+
+        if disks is not None and self.last_disks is not None:
+            for name, (sectors, ticks) in disks.items():
+                if name not in self.last_disks:
+                    continue
+                busy = min(1.0, (ticks - self.last_disks[name][1]) / 1000 / elapsed)
+                if result["disk_busy"] is None or busy > result["disk_busy"]:
+                    result["disk"] = name
+                    result["disk_busy"] = busy
+                    result["disk_read"] = 512 * (sectors - self.last_disks[name][0]) / elapsed
+
+        self.last_time, self.last_cpu, self.last_disks = now, cpu, disks
+        return result
+
+
+class ConcurrencyTuner:
+    """
+    ContextManager running a thread that periodically samples CPU, disk utilisation, the read latency measured
+    by limiter (an AdaptiveConcurrency) and the total ffmpeg decoding speed and sets the number of active
+    workers of limiter between minimum and maximum:
+    - more workers while there is headroom on the CPUs and the busiest disk and the read latency is low
+    - fewer workers when one of them is saturated or the read latency is above the target
+    - an additional worker is removed again if the total decoding speed dropped because of it
+    """
+
+    def __init__(self, limiter, minimum, maximum, speed=None, interval=5.0, sampler=None):
+        self.limiter = limiter
+        self.minimum = max(1, minimum)
+        self.maximum = max(self.minimum, maximum)
+        self.speed = speed
+        self.interval = interval
+        self.sampler = sampler
+        self.stopped = Event()
+        self.thread = None
+        self.last_level = None
+        self.last_speed = None
+
+    def __enter__(self):
+        if self.sampler is None:
+            self.sampler = SystemSampler()
+        self.limiter.set_limit(min(max(self.limiter.limit, self.minimum), self.maximum))
+        log.info("Concurrency: starting with %s workers (%s-%s)" % (self.limiter.limit, self.minimum, self.maximum))
+
+        self.thread = Thread(target=self.run, name="concurrency-tuner", daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stopped.set()
+        self.thread.join()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            sample = self.sampler.sample()
+            sample["speed"] = self.speed() if self.speed is not None else None
+            sample["latency"] = self.limiter.latency
+            sample["target_latency"] = self.limiter.target_latency
+            self.update(sample)
+
+    def decide(self, level, sample) -> int:
+        """The next number of workers for the current level and sample"""
+        speed = sample.get("speed")
+        if self.last_level is not None and level > self.last_level and speed is not None and self.last_speed:
+            if speed < (1 - SPEED_TOLERANCE) * self.last_speed:
+                return level - 1
+
+        # same rules as the latency control of AdaptiveConcurrency: shrink above the target, grow below half of it
+        latency, target = sample.get("latency"), sample.get("target_latency")
+        if latency is not None and target is not None:
+            if latency > target:
+                return level - 1
+            if latency >= target / 2:
+                return level
+
+        loads = [v for v in (sample.get("cpu"), sample.get("disk_busy")) if v is not None]
+        if not loads:
+            return level
+
+        if max(loads) > HIGH_WATERMARK:
+            return level - 1
+        if max(loads) < LOW_WATERMARK:
+            return level + 1
+        return level
+
+    def update(self, sample):
+        level = self.limiter.limit
+        new_level = min(max(self.decide(level, sample), self.minimum), self.maximum)
+
+        metrics = "cpu %s, disk %s %s busy %s read, read latency %s, decode speed %s" % (
+            _percent(sample.get("cpu")),
+            sample.get("disk"),
+            _percent(sample.get("disk_busy")),
+            "%.1fMB/s" % (sample["disk_read"] / 1024 / 1024) if sample.get("disk_read") is not None else "n/a",
+            "%.1fms" % (1000 * sample["latency"]) if sample.get("latency") is not None else "n/a",
+            "%.2fx" % sample["speed"] if sample.get("speed") is not None else "n/a",
+        )
+
+        if new_level != level:
+            log.info("Concurrency: %s -> %s workers (%s)" % (level, new_level, metrics))
+            self.limiter.set_limit(new_level)
+        else:
+            log.debug("Concurrency: %s workers (%s)" % (level, metrics))
+
+        self.last_level = level
+        self.last_speed = sample.get("speed")
+
+
+def _percent(value):
+    return "%.0f%%" % (100 * value) if value is not None else "n/a"
@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import logging
+from os import stat
+from videofilecheck.lib.util import SubBar
+from videofilecheck.lib.cache import is_cached
+from videofilecheck.lib.throttle import throttled_readinto
+log = logging.getLogger(__name__)
+
+# Granularity of the scan: only aligned blocks of this size that are completely zero are reported.
+# Compressed video practically never contains 64k of zeroes, container padding is much smaller.
+BLOCKSIZE = 64 * 1024
+
+# Amount of data read at once, a multiple of BLOCKSIZE
+READSIZE = 64 * BLOCKSIZE
+
+# A zeroed header is reported even if it is smaller than BLOCKSIZE
+HEADERSIZE = 1024
+
+ZERO_BLOCK = bytes(BLOCKSIZE)
+
+
+class ZeroResult:
+    """Same interface as ffmpeg.Result, additionally holds the zeroed (start, end) byte ranges"""
+
+    def __init__(self, filesize: int, ranges: list):
+        self.filesize = filesize
+        self.ranges = ranges
+        self.timeout = False
+        self.success = filesize > 0 and len(ranges) == 0
+
+    @property
+    def truncated(self):
+        """True if the file ends in zeroes, e.g. a preallocated file after a failed copy"""
+        return len(self.ranges) > 0 and self.ranges[-1][1] == self.filesize
+
+    @property
+    def output(self):
+        if self.filesize == 0:
+            return "File is empty"
+
+        lines = []
+        for start, end in self.ranges:
+            if end == self.filesize:
+                lines.append("Zeroed tail at bytes %d-%d (%d bytes, file truncated?)" % (start, end, end - start))
+            else:
+                lines.append("Zeroed range at bytes %d-%d (%d bytes)" % (start, end, end - start))
+
+        return "\n".join(lines)
+
+    def __str__(self):
+        return "ZeroResult(success=%s, ranges=%s)" % (self.success, self.ranges)
+
+    def __repr__(self):
+        return str(self)
+
+
+def _add_range(ranges, start, end):
+    if ranges and ranges[-1][1] == start:
+        ranges[-1] = (ranges[-1][0], end)
+    else:
+        ranges.append((start, end))
+
+
+def _scan_blocks(f, bar, blocksize, readinto):
+    zero_block = ZERO_BLOCK if blocksize == BLOCKSIZE else bytes(blocksize)
+    buf = bytearray(max(1, READSIZE // blocksize) * blocksize)
+    ranges = []
+    header = None
+    offset = 0
+
+    while True:
+        n = readinto(f, buf)
+
+        if not n:
+            break
+
+        if offset == 0 and buf.startswith(zero_block[:min(n, HEADERSIZE)], 0, n):
+            header = n - len(buf[:n].lstrip(b"\x00"))
+
+        for pos in range(0, n, blocksize):
+            end = min(pos + blocksize, n)
+            if buf.startswith(zero_block[:end - pos], pos, end):
+                _add_range(ranges, offset + pos, offset + end)
+
+        offset += n
+        if bar is not None:
+            bar.update(n)
+
+    return ranges, header
+
+
+def find_zero_ranges(file, bar=None, blocksize=BLOCKSIZE) -> ZeroResult:
+    """
+    Scan the whole file for aligned blocks that contain only zeroes and merge them into ranges.
+    Reads large buffers (the read releases the GIL) and compares them blockwise against a zero block,
+    which is done by memcmp instead of a python loop over every byte.
+    """
+    log.debug("Scanning %s for zeroed blocks" % file)
+
+    # Reading from the cache does not touch the disk that holds the library
+    readinto = (lambda f, buf: f.readinto(buf)) if is_cached(file) else throttled_readinto
+
+    with open(file, "rb") as f:
+        filesize = stat(f.fileno()).st_size
+
+        if bar is None:
+            ranges, header = _scan_blocks(f, None, blocksize, readinto)
+        else:
+            with SubBar(f, bar, "zero", "b") as _bar:
+                ranges, header = _scan_blocks(f, _bar, blocksize, readinto)
+
+    # a short partial block at the end of the file is only reported as part of a larger range
+    ranges = [(start, end) for start, end in ranges if end - start >= blocksize]
+
+    if header is not None and (not ranges or ranges[0][0] != 0):
+        ranges.insert(0, (0, header))
+
+    result = ZeroResult(filesize, ranges)
+    log.debug("Zero scan of %s: %s" % (file, result))
+    return result
@@ -1,19 +1,28 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 from time import time, sleep
-from os import walk, chdir, nice
-from os.path import join, expanduser, relpath, abspath, getsize, isfile
+from os import walk, nice, stat, cpu_count
+from os.path import join, expanduser, relpath, abspath, getsize, isfile, isabs, dirname, basename
 from concurrent.futures import ThreadPoolExecutor as Executor, as_completed
 import argparse
+from contextlib import ExitStack
+from itertools import zip_longest
 from tqdm import tqdm
 from threading import get_ident, Lock
 
 from .lib.database import Database
-from .lib.ffmpeg import ffmpeg_scan, ffmpeg_remux
-from .lib.checksum import checksum
+from .lib.ffmpeg import ffmpeg_scan, ffmpeg_remux, ffprobe, decode_options, Metadata, MODES
+from .lib.ffmpeg import Result, header_check, packet_index, time_ranges, ffmpeg_scan_range
+from .lib.checksum import block_checksum, BlockHashes
 from .lib.cache import CachedFile, UnCachedFile
 from .lib.tqdmlog import TqdmHandler
 from .lib.util import bcolors
+from .lib.zeroes import ZeroResult, find_zero_ranges
+from .lib.throttle import READ_LIMIT, CONCURRENCY, set_idle_io_priority
+from .lib.supervisor import SUPERVISOR
+from .lib.tuning import ConcurrencyTuner, SystemSampler, devices_of
+from .lib.roots import Root, read_roots_file, split_key
+from .lib.report import open_report, entry_filter, parse_timestamp, FORMATS, STATUSES
 
 import logging
 
@@ -26,23 +35,47 @@ log.addHandler(handler)
 
 WANTED_FILES = [".mkv", ".mp4", ".avi"]
 
+# Decode only the changed parts of a previously good file if at most this fraction of its blocks changed
+PARTIAL_SCAN_MAX_CHANGED = 0.25
+
 
 class App:
     def __init__(self, config):
-        self.nthreads = int(config.nthreads) if config.nthreads is not None else 2
+        self.auto_threads = config.nthreads == "auto"
+        self.min_threads = int(config.min_threads) if config.min_threads is not None else 1
+        self.max_threads = int(config.max_threads) if config.max_threads is not None else (cpu_count() or 2)
+        if self.auto_threads:
+            self.nthreads = self.max_threads
+        else:
+            self.nthreads = int(config.nthreads) if config.nthreads is not None else 2
         self.dbpath = abspath(expanduser(config.dbpath))
         self.db = Database(self.dbpath)
         self.force_rescan = config.force_rescan if config.force_rescan is not None else False
         self.path_only = config.path_only if config.path_only is not None else False
+        self.zero_check = True if config.zero_check else False
+        self.read_limit = float(config.read_limit) if config.read_limit is not None else None
+        self.max_latency = float(config.max_latency) if config.max_latency is not None else None
         self.verbose = True if config.verbose else False
+        self.output = abspath(expanduser(config.output)) if config.output not in (None, "-") else config.output
+        self.format = config.format
+        self.mode = config.mode if config.mode is not None else "default"
         self.worker_ids = []
         self.lock = Lock()
 
         log.debug(
-            "Settings: nthreads=%s dbpath=%s force_rescan=%s path_only=%s"
-            % (self.nthreads, self.dbpath, self.force_rescan, self.path_only)
+            "Settings: nthreads=%s auto_threads=%s dbpath=%s force_rescan=%s path_only=%s zero_check=%s read_limit=%s max_latency=%s mode=%s"
+            % (self.nthreads, self.auto_threads, self.dbpath, self.force_rescan, self.path_only, self.zero_check, self.read_limit,
+               self.max_latency, self.mode)
         )
 
+        # MB/s and ms on the command line, bytes/s and seconds internally
+        READ_LIMIT.set_rate(self.read_limit * 1024 * 1024 if self.read_limit else None)
+        # with -n auto, the tuner uses the read latency as one of its inputs instead of both changing the limit
+        CONCURRENCY.configure(self.nthreads, self.max_latency / 1000 if self.max_latency else None, adjust=not self.auto_threads)
+        if self.auto_threads:
+            # start low, the tuner adds workers while there is headroom
+            CONCURRENCY.set_limit(2)
+
     def get_worker_idx(self):
         thread_id = get_ident()
 
@@ -75,133 +108,330 @@ class App:
         videofiles = sorted([relpath(p, rootdir) for p in videofiles])
         return videofiles
 
-    def store_result_to_db(self, videofile, filehash, result):
+    def store_result_to_db(self, videofile, path, filehash, result, blocks=None):
         # limit result to 10 lines of output
         out_lines = "\n".join(result.output.splitlines()[:10])
         entry = dict(
-            videofile=videofile, hash=filehash, status=result.success, timestamp=int(time()), filesize=getsize(videofile), output=out_lines
+            videofile=videofile, hash=filehash, status=result.success, timestamp=int(time()), filesize=getsize(path), output=out_lines,
+            timeout=result.timeout
         )
 
+        if blocks is not None:
+            entry.update(blocks=blocks.blocks, blocksize=blocks.blocksize)
+
         self.db.set(entry)
         self.db.flush()
 
-    def worker(self, videofile):
+    def worker(self, videofile, path, force=False):
+        """
+        Check the file at path and store the result under the key videofile.
+        Returns (videofile, success, decoded), decoded is False if the result came from the db or the zero check
+        """
+        force = force or self.force_rescan
         try:
             worker_idx = self.get_worker_idx()
 
-            thread_title = "Thread #%s - %50.50s" % (worker_idx, videofile.split("/")[-1])
-            with tqdm(position=worker_idx, leave=False) as bar:
+            thread_title = "Thread #%s - %50.50s" % (worker_idx, path.split("/")[-1])
+            with CONCURRENCY, tqdm(position=worker_idx, leave=False) as bar:
 
                 bar.desc = thread_title
 
-                with CachedFile(videofile, bar) as vid:
-                    if self.path_only:
-                        filehash = None
-                    else:
-                        filehash = checksum(vid.cached, bar=bar)
-
-                    db_result = self.db.get(vid.original, filehash, getsize(videofile))
+                with CachedFile(path, bar) as vid:
+                    # cheap pre-filter on the cached copy, before the file is hashed and decoded
+                    zero_result = self.check_zeroes(videofile, path, bar, vid.cached) if self.zero_check else None
 
-                    if self.force_rescan:
-                        log.debug('Forcing a rescan for "%s"' % vid.original)
+                    if force:
+                        # The old result is ignored anyway, the hash is calculated after decoding
+                        log.debug('Forcing a rescan for "%s"' % videofile)
+                        filehash, blocks = None, None
                         db_result = None
+                    else:
+                        filehash, blocks = (None, None) if self.path_only else block_checksum(vid.cached, bar=bar)
+                        db_result = self.db.get(videofile, filehash, getsize(path))
 
                     if db_result is None:
-                        result = ffmpeg_scan(vid.cached, bar)
+                        result = None
+                        if zero_result is not None and not zero_result.success:
+                            log.debug("Zero check failed for %s, skipping ffmpeg" % videofile)
+                            result = zero_result
+
+                        decoded = result is None
+                        if decoded:
+                            metadata = self.probe(videofile, path, vid.cached)
+                            if blocks is not None:
+                                result = self.partial_scan(videofile, vid, blocks, metadata)
+                            if result is None:
+                                result = ffmpeg_scan(vid.cached, bar, decode_options(metadata, self.mode))
                         if filehash is None:
-                            filehash = checksum(vid.cached, bar=bar)
+                            filehash, blocks = block_checksum(vid.cached, bar=bar)
 
                         if result.success:
-                            log.info("%s - %sOK%s" % (vid.original, bcolors.OKGREEN, bcolors.ENDC))
+                            log.info("%s - %sOK%s" % (videofile, bcolors.OKGREEN, bcolors.ENDC))
+                        elif result.timeout:
+                            log.info("%s - %sTIMEOUT%s" % (videofile, bcolors.WARNING, bcolors.ENDC))
                         else:
-                            log.info("%s - %sFAIL%s" % (vid.original, bcolors.FAIL, bcolors.ENDC))
-                        self.store_result_to_db(vid.original, filehash, result)
-                        return (vid.original, result.success)
+                            log.info("%s - %sFAIL%s" % (videofile, bcolors.FAIL, bcolors.ENDC))
+                        self.store_result_to_db(videofile, path, filehash, result, blocks)
+                        return (videofile, result.success, decoded)
                     else:
-                        log.debug('Found "%s" in db, using old status %s' % (vid.original, db_result))
-                        return (vid.original, db_result)
+                        log.debug('Found "%s" in db, using old status %s' % (videofile, db_result))
+                        return (videofile, db_result, False)
         except Exception:
             import traceback
             traceback.print_exc()
 
-    def scan(self, videodir):
-        """Scan videofiles in videodir recursively. Ignore existing results if force is set"""
+    def partial_scan(self, videofile, vid, blocks, metadata):
+        """
+        Decode only the parts of a previously good file that changed since its last scan, e.g. after a metadata edit.
+        Returns None if this is not possible and the whole file has to be decoded.
+        """
+        old = self.db.get_entry(videofile)
+        if old is None or not old["status"] or "blocks" not in old:
+            return None
+
+        # a file that grew or shrank inside its last block has as many blocks as before, but parts of it moved
+        if old["filesize"] != getsize(vid.original):
+            return None
+
+        changed = blocks.changed(BlockHashes(old["blocks"], old["blocksize"]))
+        if not changed or len(changed) > PARTIAL_SCAN_MAX_CHANGED * len(blocks.digests):
+            return None
 
-        if isfile(videodir):
+        log.debug("%s: %s of %s blocks changed, decoding only the affected parts"
+                  % (videofile, len(changed), len(blocks.digests)))
+
+        result = header_check(vid.cached)
+        if not result.success:
+            return result
+
+        try:
+            packets = packet_index(vid.cached)
+        except Exception as e:
+            log.debug("Cannot read packet index of %s: %s" % (videofile, e))
+            return None
+
+        video_streams = set(s["index"] for s in metadata.video) if metadata is not None else None
+        options = decode_options(metadata, self.mode)
+
+        for start, end in time_ranges(packets, blocks.byte_ranges(changed, getsize(vid.cached)), video_streams):
+            log.debug("Decoding %s from %.1fs to %s" % (videofile, start, "%.1fs" % end if end is not None else "end"))
+            result = ffmpeg_scan_range(vid.cached, start, end, options)
+            if not result.success:
+                return result
+
+        return Result("")
+
+    def find_root_files(self, root):
+        """(key, path) of all videofiles in root"""
+        items = [(root.key(rel), join(root.path, rel)) for rel in self.find_video_files(root.path)]
+        log.debug("Found %s videofiles in %s" % (len(items), root))
+        return items
+
+    def migrate(self, roots, per_root):
+        """
+        Move entries of older databases, keyed by the path relative to the scanned directory, to the new keys.
+        per_root are the (key, path) items found in each of the roots. A relative path that exists in more than
+        one root is ambiguous, its entry is left alone instead of giving its result to a random one of the files.
+        """
+        keys = {}
+        for root, items in zip(roots, per_root):
+            for key, path in items:
+                keys.setdefault(relpath(path, root.path), set()).add(key)
+
+        for rel, candidates in keys.items():
+            if self.db.get_entry(rel) is None:
+                continue
+
+            if len(candidates) > 1:
+                log.warning("Migration: %s exists in several directories, not moving its old result" % rel)
+                continue
+
+            key = candidates.pop()
+            if self.db.get_entry(key) is None:
+                log.debug("Migration: moving %s to %s" % (rel, key))
+                self.db.rename(rel, key)
+
+    def collect(self, roots):
+        """
+        (key, path) of all videofiles in all roots. The roots are searched in parallel and their files are
+        interleaved so all disks are busy at the same time instead of one after the other
+        """
+        with Executor(max_workers=max(1, len(roots))) as exe:
+            per_root = list(exe.map(self.find_root_files, roots))
+
+        self.migrate(roots, per_root)
+
+        # nested roots find the same files
+        seen = set()
+        batches = []
+        for items in per_root:
+            unique = [item for item in items if item[0] not in seen]
+            seen.update(key for key, _ in unique)
+            batches.append(self.schedule(unique))
+
+        items = [item for batch in zip_longest(*batches) for item in batch if item is not None]
+        log.debug("Found %s videofiles in total" % len(items))
+        return items
+
+    def scan(self, videodirs):
+        """Scan videofiles in all videodirs recursively. Ignore existing results if force is set"""
+
+        if len(videodirs) == 1 and isfile(videodirs[0]):
             with tqdm() as bar:
-                print(ffmpeg_scan(videodir, bar))
+                print(ffmpeg_scan(videodirs[0], bar))
                 return
 
-        chdir(videodir)
-        vfiles = self.find_video_files(".")
-        log.debug("Found %s videofiles in total" % len(vfiles))
+        output = self.output if self.output is not None else abspath("results.txt")
+        roots = [Root(videodir) for videodir in videodirs]
+        self.scan_files(self.collect(roots), output, roots)
 
-        with Executor(max_workers=self.nthreads) as exe:
-            futures = [exe.submit(self.worker, vfile) for vfile in vfiles]
+    def tuning(self, roots):
+        """Context in which the number of active workers is tuned automatically, if enabled"""
+        if not self.auto_threads:
+            return ExitStack()
+
+        sampler = SystemSampler(devices=devices_of(root.path for root in roots))
+        return ConcurrencyTuner(CONCURRENCY, self.min_threads, self.max_threads, speed=SUPERVISOR.total_speed, sampler=sampler)
+
+    def scan_files(self, items, output, roots, force=False):
+        """Run the worker for all (key, path) items of the roots and write the results to output"""
+        weights = self.progress_weights(items)
+        weighted = weights is not None
+        if weighted:
+            progress = tqdm(total=sum(weights), unit="s", unit_scale=True, desc="Decoding (1080p equivalent)")
+        else:
+            weights, progress = [1] * len(items), tqdm(total=len(items), unit="file")
+
+        with Executor(max_workers=self.nthreads) as exe, open_report(output, self.format) as report, self.tuning(roots), progress:
+            futures = dict((exe.submit(self.worker, vfile, path, force), weight) for (vfile, path), weight in zip(items, weights))
 
             failed = []
 
-            for future in tqdm(as_completed(futures), total=len(vfiles), unit="file"):
+            for future in as_completed(futures):
+                result = future.result() if future.exception() is None else None
+                if weighted and (result is None or not result[2]):
+                    # only hashed, not decoded: the file is no part of the decoding work the ETA is based on
+                    progress.total -= futures[future]
+                    progress.refresh()
+                else:
+                    progress.update(futures[future])
+
                 sleep(0.001)  # TQDM doesnt update without a very short sleep :/
                 if future.exception() is not None:
                     log.error(future.exception())
                     continue
 
-                vfile, success = future.result()
+                if result is None:
+                    continue
+
+                vfile, success, _ = result
                 if not success:
                     failed.append(vfile)
 
+                entry = self.db.get_entry(vfile)
+                if entry is not None:
+                    report.write(entry)
+
             for vfile in failed:
                 log.warning("FAILED: %s" % vfile)
 
             self.db.flush()
 
-    def rescan(self, videodir):
-        """Rescan all files in videodir that have a previous status of FAILED"""
-        if isfile(videodir):
-            print(ffmpeg_scan(videodir))
-            return
-
-        chdir(videodir)
-        vfiles = self.find_video_files(".")
-
-        for vfile in vfiles:
-            db_result = self.db.get(vfile)
+    def rescan(self, videodirs, prefix=None, since=None, before=None, error=None):
+        """
+        Rescan the files in videodirs that have a previous status of FAILED (and match all given filters).
+        The work list comes from the database, the directories are not searched and no other file is read
+        """
+        if len(videodirs) == 1 and isfile(videodirs[0]):
+            with tqdm() as bar:
+                print(ffmpeg_scan(videodirs[0], bar))
+                return
 
-            if db_result is not None and db_result is False:
-                log.debug("Rescanning previously failed file %s" % vfile)
-                self.db.delete(vfile)
+        # the results file of the last full scan is not overwritten with the few rescanned files
+        output = self.output if self.output is not None else "-"
+        roots = [Root(videodir) for videodir in videodirs]
+
+        # the prefix is relative to the scanned directories
+        match = entry_filter("failed", None, since, error, before)
+        items = []
+        for entry in list(self.db.find(match)):
+            key = entry["videofile"]
+            root = next((r for r in roots if r.owns(key)), None)
+
+            if root is None:
+                # Entry of an older database, keyed by the path relative to one of the roots
+                candidates = [r for r in roots if isfile(join(r.path, key))]
+                if len(candidates) > 1:
+                    log.warning("Migration: %s exists in several directories, not moving its old result" % key)
+                if len(candidates) != 1:
+                    continue
+                root = candidates[0]
+                log.debug("Migration: moving %s to %s" % (key, root.key(key)))
+                self.db.rename(key, root.key(key))
+                key = root.key(key)
 
-        self.scan(videodir)
+            if prefix is not None and not key.startswith(root.key_prefix(prefix)):
+                continue
 
-    def show(self):
-        log.info("Broken Files:")
-        n_broken = 0
-        n_ok = 0
-        for _, entry in sorted(self.db.get_all()):
-            if entry["status"] is False:
-                log.info(entry["videofile"])
-                if "output" in entry:
-                    for l in entry["output"].splitlines():
-                        log.info("> " + l)
-                n_broken += 1
+            path = root.path_of(key)
+            if isfile(path):
+                items.append((key, path))
             else:
-                n_ok += 1
+                log.warning("Previously failed file %s does not exist anymore" % path)
+
+        log.info("Rescanning %s previously failed files" % len(items))
+        self.scan_files(self.schedule(items), output, roots, force=True)
+
+    def show(self, status="failed", prefix=None, since=None, error=None, before=None):
+        """
+        Write the database entries matching all given filters to the output (Default: stdout).
+        An absolute prefix is a path on disk, a relative one is compared to the path of a file within its filesystem.
+        """
+        key_prefix = None
+        if prefix is not None and isabs(expanduser(prefix)):
+            prefix = expanduser(prefix)
+            key_prefix, prefix = Root(dirname(prefix)).key_prefix(basename(prefix)), None
+
+        match = entry_filter(status, prefix, since, error, before)
+        n_broken = 0
+        n_total = 0
+
+        with open_report(self.output if self.output is not None else "-", self.format) as report:
+            for entry in self.db.find():
+                n_total += 1
+                if not entry["status"]:
+                    n_broken += 1
+
+                if match(entry) and (key_prefix is None or entry["videofile"].startswith(key_prefix)):
+                    report.write(entry)
+
+        log.info("Showing %s matching files" % report.count)
+
+        if n_total > 0:
+            log.info("Found issues with %s/%s files (%.1f%%)" % (n_broken, n_total, 100 * float(n_broken) / n_total))
+        else:
+            log.info("The database is empty")
+
+    def prune(self, videodirs):
+        """Remove files of the videodirs from the database that no longer exist"""
+        roots = [Root(videodir) for videodir in videodirs]
+        per_root = [self.find_root_files(root) for root in roots]
+        self.migrate(roots, per_root)
+        vfiles = set(key for items in per_root for key, _ in items)
+        log.debug("Found %s videofiles in total" % len(vfiles))
 
-        log.info(
-            "Found issues with %s/%s files (%.1f%%)"
-            % (n_broken, n_broken + n_ok, 100 * float(n_broken) / (n_broken + n_ok))
-        )
+        # Entries of older databases that were not migrated: their file does not exist in any of the roots anymore
+        # (or in several of them, then they are kept)
+        rels = set(relpath(path, root.path) for root, items in zip(roots, per_root) for _, path in items)
 
-    def prune(self, videodir):
-        """Remove files from the database that no longer exist in the videodir"""
-        chdir(videodir)
-        vfiles = self.find_video_files(".")
-        log.debug("Found %s videofiles in total" % len(vfiles))
+        def orphan(key):
+            if split_key(key)[0] == "":
+                return key not in rels
+            return key not in vfiles and any(root.owns(key) for root in roots)
 
         # Get a list of files that don't exist anymore
         # Have to copy the strings, we can't delete from the db while iterating over it
-        orphan_files = list(map(lambda p: p[0], filter(lambda p: p[0] not in vfiles, self.db.get_all())))
+        orphan_files = [key for key, _ in self.db.get_all() if orphan(key)]
 
         for orphan in orphan_files:
             log.info("Deleting %s" % orphan)
@@ -211,37 +441,132 @@ class App:
 
         self.db.flush()
 
-    def find_zeroes(self, videodir):
-        chdir(videodir)
-        vfiles = self.find_video_files(".")
-
-        for vfile in vfiles:
-            with open(vfile, "rb") as f:
-                chunk = f.read(1024)
-                for b in chunk:
-                    if b != 0x0:
-                        print(" OK " + vfile)
-                        break
+    def check_zeroes(self, videofile, path, bar=None, cached=None):
+        """Zero scan of the file at path (read from cached, e.g. the cached copy), cached in the db"""
+        st = stat(path)
+        mtime = int(st.st_mtime)
+        entry = None if self.force_rescan else self.db.get_zeroes(videofile, st.st_size, mtime)
+
+        if entry is not None:
+            log.debug("Found zero scan of %s in db" % videofile)
+            return ZeroResult(entry["filesize"], [tuple(r) for r in entry["ranges"]])
+
+        result = find_zero_ranges(cached if cached is not None else path, bar)
+        self.db.set_zeroes(
+            dict(videofile=videofile, filesize=st.st_size, mtime=mtime, timestamp=int(time()), ranges=result.ranges)
+        )
+        return result
+
+    def probe(self, videofile, path, cached=None):
+        """ffprobe metadata of the file at path (read from cached, e.g. the cached copy), cached in the db. None on errors"""
+        st = stat(path)
+        mtime = int(st.st_mtime)
+        entry = None if self.force_rescan else self.db.get_probe(videofile, st.st_size, mtime)
+
+        if entry is not None:
+            return Metadata(entry["metadata"])
+
+        try:
+            metadata = ffprobe(cached if cached is not None else path)
+        except Exception as e:
+            log.debug("ffprobe failed for %s: %s" % (videofile, e))
+            return None
+
+        self.db.set_probe(dict(videofile=videofile, filesize=st.st_size, mtime=mtime, metadata=metadata.info))
+        return metadata
+
+    def estimated_cost(self, videofile):
+        """Decoding cost from the (possibly outdated) metadata in the db, None if the file was never probed"""
+        entry = self.db.get_probe(videofile, None, None)
+        return Metadata(entry["metadata"]).cost if entry is not None else None
+
+    def schedule(self, items):
+        """
+        Order (key, path) items so the most expensive ones are started first and the pool does not wait for a single
+        large file at the end. Files without metadata are new or changed and need to be decoded anyway, they come first.
+        """
+        costs = dict((vfile, self.estimated_cost(vfile)) for vfile, _ in items)
+        known = [c for c in costs.values() if c is not None]
+        if known:
+            log.debug("Estimated decoding work of %s known files: %.1f hours of 1080p video" % (len(known), sum(known) / 3600))
+
+        return sorted(items, key=lambda item: (costs[item[0]] is not None, -(costs[item[0]] or 0)))
+
+    def progress_weights(self, items):
+        """
+        Estimated decoding cost of every (key, path) item, so the progress and ETA follow the actual work instead of
+        the number of files. Files without metadata count as an average file. None if no cost is known at all.
+        """
+        costs = [self.estimated_cost(vfile) for vfile, _ in items]
+        known = [c for c in costs if c]
+        if not known:
+            return None
+
+        average = sum(known) / len(known)
+        return [c if c else average for c in costs]
+
+    def zero_worker(self, videofile, path):
+        worker_idx = self.get_worker_idx()
+
+        with CONCURRENCY, tqdm(position=worker_idx, leave=False) as bar:
+            bar.desc = "Thread #%s - %50.50s" % (worker_idx, path.split("/")[-1])
+            return (videofile, self.check_zeroes(videofile, path, bar))
+
+    def find_zeroes(self, videodirs):
+        """Scan the whole content of all videofiles in videodirs for zeroed blocks and truncated tails"""
+        roots = [Root(videodir) for videodir in videodirs]
+        items = self.collect(roots)
+
+        with Executor(max_workers=self.nthreads) as exe, self.tuning(roots):
+            futures = [exe.submit(self.zero_worker, vfile, path) for vfile, path in items]
+
+            for future in tqdm(as_completed(futures), total=len(items), unit="file"):
+                if future.exception() is not None:
+                    log.error(future.exception())
+                    continue
+
+                vfile, result = future.result()
+                if result.success:
+                    log.debug(" OK " + vfile)
                 else:
-                    print("ERR " + vfile)
+                    log.info("ERR " + vfile)
+                    for l in result.output.splitlines():
+                        log.info("> " + l)
+
+        self.db.flush()
+
 
 def cli():
     nice(15)
     parser = argparse.ArgumentParser()
     subparsers = parser.add_subparsers(title="command", help="Command", dest="command")
+    rescan_parser = subparsers.add_parser("rescan")
+    remux_parser = subparsers.add_parser("remux")
     scanning_parsers = [subparsers.add_parser("scan"),
-                        subparsers.add_parser("rescan"),
-                        subparsers.add_parser("remux"),
+                        rescan_parser,
+                        remux_parser,
                         subparsers.add_parser("prune"),
                         subparsers.add_parser("zero")]
-    all_parsers = [*scanning_parsers, subparsers.add_parser("show")]
+    show_parser = subparsers.add_parser("show")
+    all_parsers = [*scanning_parsers, show_parser]
 
     for p in scanning_parsers:
-        p.add_argument("videodir", help="Directory that will be recursively scanned")
+        if p is remux_parser:
+            p.add_argument("videodir", help="File that will be remuxed")
+            continue
+
+        p.add_argument("videodirs", help="Directories that will be recursively scanned", nargs="*")
+        p.add_argument("--roots", help="File with additional directories to scan, one per line")
 
     for p in all_parsers:
         p.add_argument("-v", "--verbose", help="log more", action="store_true")
-        p.add_argument("-n", "--nthreads", help="Number of threads to run in parallel (Default: 2)")
+        p.add_argument(
+            "-n",
+            "--nthreads",
+            help="Number of threads to run in parallel, auto to adapt it to the CPU and disk load (Default: 2)",
+        )
+        p.add_argument("--min-threads", help="Minimum number of threads for -n auto (Default: 1)")
+        p.add_argument("--max-threads", help="Maximum number of threads for -n auto (Default: number of CPUs)")
         p.add_argument("-d", "--dbpath", help="Database path to use to store results (Default: ~/.vcheck.json)", default="~/.vcheck.json")
         p.add_argument(
             "-f",
@@ -255,34 +580,80 @@ def cli():
             help="Only scan files using their path, skip hashing file content (Default: No)",
             action="store_true",
         )
+        p.add_argument(
+            "-z",
+            "--zero-check",
+            help="Check files for zeroed blocks before decoding them, skip ffmpeg if there are any (Default: No)",
+            action="store_true",
+        )
+        p.add_argument("-r", "--read-limit", help="Limit the combined read rate of all threads in MB/s (Default: unlimited)")
+        p.add_argument(
+            "-l",
+            "--max-latency",
+            help="Run fewer threads while the 90th percentile latency of 1MB reads is above this many milliseconds (Default: disabled)",
+        )
+        p.add_argument(
+            "-o",
+            "--output",
+            help="File to write the results to, - for stdout (Default: results.txt for scan, stdout for rescan and show)",
+        )
+        p.add_argument(
+            "-m",
+            "--mode",
+            help="Streams to decode: ffmpeg's default selection, all audio/video streams or video only (Default: default)",
+            choices=sorted(MODES),
+        )
+        p.add_argument("--format", help="Format of the output (Default: guessed from the file extension)", choices=FORMATS)
+        p.add_argument("-i", "--io-idle", help="Only read from disk when no other program does (Default: No)", action="store_true")
+
+    show_parser.add_argument("--status", help="Only show files with this status (Default: failed)", choices=STATUSES,
+                             default="failed")
+
+    for p in [show_parser, rescan_parser]:
+        p.add_argument("--prefix", help="Only use files whose path starts with this prefix, relative to the scanned "
+                       "directories (rescan) or the filesystem (show) unless it is absolute")
+        p.add_argument("--since", help="Only use files scanned since this unix timestamp or date (YYYY-MM-DD)",
+                       type=parse_timestamp)
+        p.add_argument("--before", help="Only use files scanned before this unix timestamp or date (YYYY-MM-DD)",
+                       type=parse_timestamp)
+        p.add_argument("--error", help="Only use files whose error output contains this text")
 
     args = parser.parse_args()
 
+    if args.io_idle:
+        set_idle_io_priority()
+
     baselogger = logging.getLogger("videofilecheck")
     if args.verbose:
         baselogger.setLevel(logging.DEBUG)
     else:
         baselogger.setLevel(logging.INFO)
 
+    videodirs = None
+    if args.command in ("scan", "rescan", "prune", "zero"):
+        videodirs = args.videodirs + (read_roots_file(args.roots) if args.roots is not None else [])
+        if not videodirs:
+            parser.error("%s needs at least one directory, either as argument or using --roots" % args.command)
+
     app = App(args)
 
     if args.command == "scan":
-        log.info("Running scan on video(s) at %s" % args.videodir)
-        app.scan(args.videodir)
+        log.info("Running scan on video(s) at %s" % ", ".join(videodirs))
+        app.scan(videodirs)
     elif args.command == "rescan":
-        log.info("Running rescan on video(s) at %s" % args.videodir)
-        app.rescan(args.videodir)
+        log.info("Running rescan on video(s) at %s" % ", ".join(videodirs))
+        app.rescan(videodirs, args.prefix, args.since, args.before, args.error)
     elif args.command == "show":
         log.info("Showing results")
-        app.show()
+        app.show(args.status, args.prefix, args.since, args.error, args.before)
     elif args.command == "remux":
         log.info("Remuxing %s" % args.videodir)
         ffmpeg_remux(file=args.videodir)
     elif args.command == "prune":
-        log.info("Pruning database %s using directory %s" % (args.dbpath, args.videodir))
-        app.prune(args.videodir)
+        log.info("Pruning database %s using directories %s" % (args.dbpath, ", ".join(videodirs)))
+        app.prune(videodirs)
     elif args.command == "zero":
-        app.find_zeroes(args.videodir)
+        app.find_zeroes(videodirs)
     else:
         parser.print_usage()
         exit(1)